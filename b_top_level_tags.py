@@ -1,13 +1,25 @@
-""" Top level tags in the document """
-
-import xml.etree.cElementTree as ET
-from collections import defaultdict
-
-
-def count_tags(filename):
-    tags = defaultdict(int)
-    for event, element in ET.iterparse(filename):
-        tags[element.tag] += 1
-    return tags
-
-print(count_tags('buenos-aires_argentina.osm'))
\ No newline at end of file
+""" Top level tags in the document """
+
+import argparse
+import xml.etree.cElementTree as ET
+from collections import defaultdict
+from osm_io import open_osm
+
+
+def count_tags(filename):
+    tags = defaultdict(int)
+    with open_osm(filename) as f:
+        for event, element in ET.iterparse(f):
+            tags[element.tag] += 1
+    return tags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the tags of an osm file")
+    parser.add_argument('osm_file', nargs='?', default='buenos-aires_argentina.osm')
+    args = parser.parse_args()
+    print(count_tags(args.osm_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,186 @@
-""" Audit coordinates"""
-
-import xml.etree.cElementTree as ET
-
-
-def check_coordinates(osmfile):
-    """ Checks if the coordinates of an osm file are within the Buenos Aires province area
-
-        Args:
-        osmfile(xml file): from OpenStreetMap"""
-    tree = ET.parse(osmfile)
-    root = tree.getroot()
-    # All of the below min and max values where manually selected by me using Google maps
-    min_lat = -41.06
-    max_lat = -33.31
-    min_lon = -63.43
-    max_lon = -56.77
-    for child in root:
-        if child.tag == "node":
-            latitude = float(child.attrib["lat"])
-            longitude = float(child.attrib["lon"])
-            if latitude > max_lat or latitude < min_lat or longitude > max_lon or longitude < min_lon:
-                print("latitude", latitude)
-                print("longitude", longitude)
-    print("All coordinates are ok")
-
-
-check_coordinates("buenos-aires_argentina.osm")
+""" Audit coordinates"""
+
+import argparse
+import xml.etree.cElementTree as ET
+import numpy as np
+from osm_io import open_osm
+
+# All of the below min and max values where manually selected by me using Google maps
+MIN_LAT = -41.06
+MAX_LAT = -33.31
+MIN_LON = -63.43
+MAX_LON = -56.77
+
+# Outline of the Buenos Aires province as (longitude, latitude) points, drawn by hand following the Parana river,
+# the Rio de la Plata and Atlantic coast, the Rio Negro and the border with Cordoba, La Pampa and Santa Fe. It is
+# approximate (a few km), but unlike the rectangle above it leaves out Uruguay, the sea and the other provinces
+BA_PROVINCE_POLYGON = [
+    (-60.40, -33.26), (-60.10, -33.30), (-59.60, -33.65), (-59.00, -34.05), (-58.50, -34.20), (-58.35, -34.50),
+    (-58.20, -34.68), (-57.85, -34.82), (-57.15, -35.35), (-57.30, -35.85), (-56.66, -36.30), (-56.85, -37.10),
+    (-57.50, -38.00), (-58.70, -38.60), (-60.10, -38.95), (-61.30, -39.05), (-62.20, -38.85), (-62.10, -39.40),
+    (-62.15, -40.50), (-62.80, -41.06), (-63.39, -40.80), (-63.39, -34.00), (-61.10, -34.00), (-60.90, -33.55)]
+
+COORDINATES_DTYPE = np.dtype([('id', np.int64), ('lat', np.float64), ('lon', np.float64)])
+
+
+def read_coordinates(osmfile, chunk_size=1000000):
+    """ Streams the id, latitude and longitude of the nodes of an osm file in chunks
+
+    Args:
+        osmfile(str): name of the osm file
+        chunk_size(int): number of nodes in each chunk
+    Yields:
+        ids, lats, lons(numpy arrays): at most chunk_size nodes
+    """
+    ids, lats, lons = [], [], []
+    with open_osm(osmfile) as f:
+        context = iter(ET.iterparse(f, events=('start', 'end')))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'start' and elem.tag == 'node':
+                attrib = elem.attrib
+                ids.append(attrib['id'])
+                lats.append(attrib['lat'])
+                lons.append(attrib['lon'])
+                if len(ids) == chunk_size:
+                    yield _to_arrays(ids, lats, lons)
+                    ids, lats, lons = [], [], []
+            elif event == 'end' and elem.tag in ('node', 'way', 'relation'):
+                root.clear()
+    if ids:
+        yield _to_arrays(ids, lats, lons)
+
+
+def _to_arrays(ids, lats, lons):
+    """ Converts the lists of strings read from the osm file to numpy arrays"""
+    return np.array(ids, dtype=np.int64), np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64)
+
+
+def outside_mask(lats, lons, polygon=None):
+    """ Returns a boolean array that is True for the coordinates outside the Buenos Aires area
+
+    Args:
+        lats, lons(numpy arrays): coordinates to check
+        polygon(list): (longitude, latitude) points of the boundary, like BA_PROVINCE_POLYGON. If it is None the
+            MIN_LAT, MAX_LAT, MIN_LON, MAX_LON rectangle is used
+    """
+    if polygon is None:
+        return (lats > MAX_LAT) | (lats < MIN_LAT) | (lons > MAX_LON) | (lons < MIN_LON)
+    # Ray casting: a point is inside if a ray going east from it crosses the boundary an odd number of times.
+    # The loop is over the edges of the polygon, each edge is checked against all the points at once
+    inside = np.zeros(len(lats), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(polygon, polygon[1:] + polygon[:1]):
+        if y1 == y2:
+            continue
+        crosses = (y1 > lats) != (y2 > lats)
+        x_cross = x1 + (lats - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (lons < x_cross)
+    return ~inside
+
+
+def audit_coordinates(osmfile, polygon=None, chunk_size=1000000):
+    """ Finds the nodes of an osm file whose coordinates are outside the Buenos Aires area
+
+    Args:
+        osmfile(str): name of the osm file
+        polygon(list): boundary used by outside_mask, the rectangle if it is None
+        chunk_size(int): number of nodes checked at once
+    Returns:
+        report(dict): 'checked' (number of nodes), 'boundary' ('rectangle' or 'polygon') and 'outliers' (numpy
+            array with the id, lat and lon of each node outside the area)
+    """
+    checked = 0
+    outliers = []
+    for ids, lats, lons in read_coordinates(osmfile, chunk_size):
+        checked += len(ids)
+        outliers.append(_outliers(ids, lats, lons, polygon))
+    return _report(checked, polygon, outliers)
+
+
+def _report(checked, polygon, outliers):
+    """ Returns the report of audit_coordinates from the number of nodes checked and the outliers of each chunk"""
+    return {'checked': checked,
+            'boundary': 'rectangle' if polygon is None else 'polygon',
+            'outliers': np.concatenate(outliers) if outliers else np.zeros(0, dtype=COORDINATES_DTYPE)}
+
+
+def _outliers(ids, lats, lons, polygon):
+    """ Returns a COORDINATES_DTYPE array with the nodes outside the area"""
+    mask = outside_mask(lats, lons, polygon)
+    found = np.zeros(int(mask.sum()), dtype=COORDINATES_DTYPE)
+    found['id'] = ids[mask]
+    found['lat'] = lats[mask]
+    found['lon'] = lons[mask]
+    return found
+
+
+def check_coordinates(osmfile, polygon=None):
+    """ Checks if the coordinates of an osm file are within the Buenos Aires province area
+
+        Args:
+        osmfile(xml file): from OpenStreetMap
+        polygon(list): boundary used by outside_mask, the rectangle if it is None"""
+    print_report(audit_coordinates(osmfile, polygon))
+
+
+def print_report(report):
+    """ Prints the coordinates of the outliers of a report of audit_coordinates, or that all of them are ok"""
+    for node in report['outliers']:
+        print("latitude", node['lat'])
+        print("longitude", node['lon'])
+    if len(report['outliers']) == 0:
+        print("All coordinates are ok")
+
+
+def is_inside_area(latitude, longitude):
+    """ Returns True if the coordinates are within the Buenos Aires province area"""
+    return MIN_LAT <= latitude <= MAX_LAT and MIN_LON <= longitude <= MAX_LON
+
+
+class CoordinateAuditStage(object):
+    """ Pipeline stage that collects the nodes whose coordinates are outside the Buenos Aires province area. The
+    coordinates are checked in chunks with outside_mask and finish returns the same report as audit_coordinates
+
+    Args:
+        polygon(list): boundary used by outside_mask, the rectangle if it is None
+        chunk_size(int): number of nodes checked at once
+    """
+
+    def __init__(self, polygon=None, chunk_size=100000):
+        self.polygon = polygon
+        self.chunk_size = chunk_size
+        self.ids, self.lats, self.lons = [], [], []
+        self.checked = 0
+        self.outliers = []
+
+    def process(self, element):
+        if element.tag == "node":
+            self.ids.append(element.attrib["id"])
+            self.lats.append(element.attrib["lat"])
+            self.lons.append(element.attrib["lon"])
+            if len(self.ids) == self.chunk_size:
+                self._check()
+        return element
+
+    def _check(self):
+        self.checked += len(self.ids)
+        self.outliers.append(_outliers(*_to_arrays(self.ids, self.lats, self.lons), polygon=self.polygon))
+        self.ids, self.lats, self.lons = [], [], []
+
+    def finish(self):
+        if self.ids:
+            self._check()
+        return _report(self.checked, self.polygon, self.outliers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the nodes of an osm file are inside Buenos Aires")
+    parser.add_argument('osm_file', nargs='?', default="buenos-aires_argentina.osm")
+    parser.add_argument('--polygon', action='store_true',
+                        help="use the outline of the province instead of the min/max rectangle")
+    args = parser.parse_args()
+    check_coordinates(args.osm_file, BA_PROVINCE_POLYGON if args.polygon else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,216 +1,359 @@
-""" Audit postal codes"""
-
-import csv
-import xml.etree.cElementTree as ET
-
-
-""" I found a data set with the postal codes of the entire Buenos Aires province and now I want to verify if the codes
-that I got, match with the ones in the file.
-This is where I found the postal codes: https://yadi.sk/d/WIc5FNVEtk9U8 """
-
-
-def audit_postal_codes():
-    """ Process postal codes from osm data from Buenos Aires province, Argentina
-
-    Returns:
-        strangepc_dict(dict): containing postal codes from the function deal_strange_pc
-        invalid_pc(set): postal codes whose length < 4
-        not_in_set_pc(set): postal codes not found in the validation data obtained from a different source
-            (set_postalcodes)"""
-
-    invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc = process_pc_sets()
-    strangepc_dict = deal_strange_pc(strange_pc)
-    return strangepc_dict, invalid_pc, not_in_set_pc
-
-
-def get_postalcode_set(csv_file):
-    """ Creates a set of the all postal codes found in the csv data set (https://yadi.sk/d/WIc5FNVEtk9U8)
-
-    Args:
-        csv_file(str): the Buenos Aires postal codes dataset
-    Returns:
-        postal_codes(set): a set of the postal codes in the csv"""
-
-    postal_codes = set()
-    with open(csv_file, "r") as csvfile:
-        csvread = csv.reader(csvfile)
-        next(csvread, None)  # to start from the second row
-        for row in csvread:
-            p_code = row[1][1:5]
-            postal_codes.add(p_code)
-    return postal_codes
-
-
-"""Now I want to verify the match between the postal codes set and the ones in the osm data"""
-
-
-def verify_postal_codes(osm):
-    """ Audits postal codes from a Buenos Aires osm file
-
-    Args:
-        osm: input Buenos Aires OSM data
-    Returns:
-        invalid_pc(set): This set will contain the postal codes whose length is < 4
-        not_in_set_pc(set): Postal codes not found in the set_postalcodes set
-        not_in_set_cut(list): A list containing the postal codes whose length is >4 that were cutted and are not in
-            the set
-        strange_pc(set): Strange postal codes who did not enter in any of the above cases
-        """
-    set_postalcodes = get_postalcode_set("BA_postalcodes.csv")
-    invalid_pc = set()
-    in_set_pc = set()  # Postal codes found in the valid postal codes set (set_postalcodes)
-    not_in_set_pc = set()
-    not_in_set_cut = []
-    strange_pc = set()
-    tree = ET.parse(osm)
-    root = tree.getroot()
-    for child in root:
-        if child.tag == "node":
-            for tag in child.iter("tag"):
-                if get_postal_code(tag):
-                    p_code = tag.attrib['v']
-                    if len(p_code) < 4:
-                        invalid_pc.add(p_code)
-                    elif len(p_code) == 4 and (p_code in set_postalcodes):
-                        in_set_pc.add(p_code)
-                    elif len(p_code) == 4 and (p_code not in set_postalcodes):
-                        not_in_set_pc.add(p_code)
-                    elif len(p_code) == 8:
-                        p_code4 = p_code[1:5]
-                        if p_code4 not in set_postalcodes:
-                            not_in_set_cut.append(p_code4)
-                        else:
-                            in_set_pc.add(p_code4)
-                    else:
-                        strange_pc.add(p_code)
-    return invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc
-
-
-def get_postal_code(elem):
-    """ Given a tag of a osm file, this returns postal code for a given attribute
-
-    Args:
-        elem(Element)
-    """
-    return elem.attrib['k'] == "addr:postcode"
-
-
-def process_pc_sets():
-    """ Individually process the postal codes sets returned from verify_postal_codes"""
-
-    invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc = verify_postal_codes("buenos-aires_argentina.osm")
-
-    """
-    Now I want to study all the postal codes that did not appear in the set_postalcodes to analyze if the codes 
-    actually exist and are missing in the csv file or if those are invalid postal codes.
-    
-    To do this, I'll analyze each of the not_in_set_pc variable and google them to see if I find them:
-    
-    not_in_set_pc {'1720', '0237', '1299', '1404', '1523', '1475', '0000', '1515', '1776', '1522', '1000', 
-    '!923', '1418', '1456', '1423'}
-    
-    - 1776: corresponds to 'localidad 9 de Abril', in Buenos Aires province and this matches with the data in the osm
-    - 1423: does exists, corresponds to a place in 'San Isidro' but in the osm file, this is the only occurrence and does
-    not match with the place it's supposed to be
-    - !923: does not exist
-    - 0237: does not exist
-    - 1418: does not exist
-    - 1456: does not exist
-    - 1299: exists but does not correspond to the place in the osm
-    - 1000: does not exist
-    - 0000: does not exist
-    - 1523: does not exist
-    - 1720: does not exist
-    - 1522: does not exist
-    - 1475: does not exist
-    - 1515: does not exist
-    - 1404: does not exist
-    
-    All of the postal codes that do not exist only appear once in the whole document"""
-
-    """ Analyzing all of the postal codes from strange_pc set:
-    strange_pc {'B1629', '1619, 1623', 'C1439AG', '1170ACG', 'C1006', 'B1663', 'B1631', 'B1702', 'P1091', '1.619', 
-    'C1107', '70000', '1686S', '1425AAJ', 'B1653', 'B1900', '1.852'}
-    
-    All of the postal codes who entered in this set have a length > 4 but < 8 and most of them start with a letter, 
-    which makes me think that they were not entered correctly in openstreetmap, as that notation seems to be a mix 
-    between the old one (only 4-digit numbers) and the new one (8-character postal codes)
-    
-    I'll analyze each of the codes individually:
-     
-    - 1425AAJ -> 1425 -> corresponds to Recoleta, a neighborhood in Buenos Aires 
-    - 70000 does not exist
-    - C1107 -> 1107 -> Juana Manso from 602 to 700, a street in Buenos Aires
-    - B1702 -> 1702 -> Ciudadela and Jose Ingenieros
-    - B1663 -> 1663 -> Muñiz or San Miguel
-    - C1006-> 1006 -> Calle Maipu from 701 to 799 in Buenos Aires.
-    - B1631 -> 1631 -> Localidad Villa Rosa
-    - C1439AG -> 1439 -> Calle Soldado De La Frontera from 5001 to 5099 in Buenos Aires.
-    - 1170ACG -> 1170 -> Calle Dr Tomas De Anchorena, from 501 to 599 
-    - B1653 -> 1653 -> Villa Ballester
-    - P1091 -> 1091 -> Moreno
-    - B1900 -> 1900 -> La Plata
-    - 1.852 -> 1852 -> Ministro Rivadavia or Burzaco
-    - B1629 -> 1629 -> Almirante Irizar, Barrio San Alejo
-    - 1686S -> 1686 -> Hurlingham and William Morris	
-    - '1619, 1623': The actual postal code for that point in the osm is 1625"""
-
-    """From not_in_set_cut:    
-    not_in_set_cut ['anfi', '1652']
-    Neither of the two exist"""
-
-    """ As almost all of the postal codes in strange_pc do exist and the value 70000 is the only one that does not exist,
-    I'm going to move the 70000 element from the strange_pc set to the not_in_setpc so I can later modify all of the
-    remaining postal codes in strange_pc"""
-    strange_pc.remove('70000')
-    invalid_pc.add('70000')
-    return invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc
-
-
-def deal_strange_pc(strange_set):
-    """Given the results of the analysis of the strange_set, this function modifies each of the postal codes to make
-    them comply with the four-digit format
-
-    Args:
-        strange_set(set)
-    Returns:
-        strange_dic(dict)
-        """
-    strange_dic = {}
-    for val in strange_set:
-        if val[1] == '.':
-            new_val = val.replace('.', '')
-            strange_dic[val] = new_val
-        elif len(val) > 8:
-            strange_dic[val] = '1625'
-        elif is_int(val[0]):
-            strange_dic[val] = val[:4]
-        else:
-            strange_dic[val] = val[1:5]
-    """ Now, I'm going to add the value from the not in set variable that is an actual postal code and is not 
-    in the set_postalcodes"""
-    strange_dic['1776'] = '1776'
-    return strange_dic
-
-
-def is_int(string):
-    """ Evaluates if a string can be changed to int and returns a boolean"""
-    try:
-        int(string)
-        return True
-    except ValueError:
-        return False
-
-
-def main():
-    invalid, not_in_set, not_inset_cut, strange = verify_postal_codes("buenos-aires_argentina.osm")
-    print(""" These are the obtained results when the verify_postal_codes function runs, these correspond to the 
-          compilation of sets and lists that later are processed""")
-    print("invalid_pc", invalid)
-    print("not_in_set_pc", not_in_set)
-    print("not_in_set_cut", not_inset_cut)
-    print("strange_pc", strange)
-
-if __name__ == '__main__':
-    main()
-
+""" Audit postal codes"""
+
+import argparse
+import re
+from collections import namedtuple
+from osm_io import iter_elements, ELEMENT_TAGS, PARSER_CODE
+from postal_index import PostalCodeIndex
+from stage_cache import CACHE, add_cache_arguments, cache_from_args
+
+
+""" I found a data set with the postal codes of the entire Buenos Aires province and now I want to verify if the codes
+that I got, match with the ones in the file.
+This is where I found the postal codes: https://yadi.sk/d/WIc5FNVEtk9U8 """
+
+OSMFILE = "buenos-aires_argentina.osm"
+POSTALCODES_FILE = "BA_postalcodes.csv"
+
+KEEP = 'keep'
+DELETE = 'delete'
+CODE = 'code'
+PostcodeRule = namedtuple('PostcodeRule', ['name', 'pattern', 'result', 'validate'])
+
+# How each value of an addr:postcode tag is cleaned, from the analysis made in process_pc_sets. The first rule whose
+# pattern matches the whole value is used. Its result is KEEP to keep the value, DELETE to delete the tag, CODE for
+# the 4 digits that PostalCodeIndex.parse reads from the value, or a template like r'\1' with the groups of the
+# pattern. With validate the cleaned code has to be in the PostalCodeIndex, otherwise the tag is deleted. New dirty
+# values only need a new rule
+POSTCODE_RULES = [
+    PostcodeRule('existing', r'1776', KEEP, False),  # Not in the postal codes file but the code does exist
+    PostcodeRule('non_existent', r'70000', DELETE, False),  # Looks like a strange postal code but it does not exist
+    PostcodeRule('invalid', r'.{0,3}', DELETE, False),
+    PostcodeRule('four_digits', r'.{4}', KEEP, True),
+    PostcodeRule('cpa', r'.{8}', KEEP, False),
+    PostcodeRule('dotted', r'[0-9]\.[0-9]{3}', CODE, False),  # 1.852
+    PostcodeRule('two_codes', r'1619, 1623', '1625', False),  # the actual postal code of that point
+    PostcodeRule('cpa_prefix', r'[A-Z]?[0-9]{4}[A-Z]{0,3}', CODE, False),  # C1439AG, B1663, 1686S
+    # Values that were not analysed, they are only kept if their 4 digits are a valid code
+    PostcodeRule('digit_first', r'([0-9].{3}).*', r'\1', True),
+    PostcodeRule('other', r'.(.{4}).*', r'\1', True),
+]
+
+
+def audit_postal_codes(osmfile=OSMFILE, cache=CACHE):
+    """ Process postal codes from osm data from Buenos Aires province, Argentina
+
+    Args:
+        osmfile(str): name of the osm file
+        cache(StageCache): see verify_postal_codes
+    Returns:
+        strangepc_dict(dict): containing postal codes from the function deal_strange_pc
+        invalid_pc(set): postal codes whose length < 4
+        not_in_set_pc(set): postal codes not found in the validation data obtained from a different source
+            (set_postalcodes)"""
+
+    invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc = process_pc_sets(osmfile, cache)
+    # the not_in_set_pc that the rules keep, like 1776, do exist
+    strangepc_dict = deal_strange_pc(strange_pc | not_in_set_pc, get_postal_index(POSTALCODES_FILE))
+    return strangepc_dict, invalid_pc, not_in_set_pc
+
+
+def get_postalcode_set(csv_file):
+    """ Creates a set of the all postal codes found in the csv data set (https://yadi.sk/d/WIc5FNVEtk9U8). The codes
+    are read from its PostalCodeIndex, which is only built again when the csv file changes
+
+    Args:
+        csv_file(str): the Buenos Aires postal codes dataset
+    Returns:
+        postal_codes(set): a set of the postal codes in the csv"""
+
+    return set(get_postal_index(csv_file).codes())
+
+
+def get_postal_index(csv_file=POSTALCODES_FILE):
+    """ Returns the PostalCodeIndex of the csv data set, used to clean the postal codes. It is only built again when
+    the csv file changes
+
+    Args:
+        csv_file(str): the Buenos Aires postal codes dataset
+    Returns:
+        postal_index(PostalCodeIndex)"""
+
+    return PostalCodeIndex.load(csv_file)
+
+
+"""Now I want to verify the match between the postal codes set and the ones in the osm data"""
+
+
+def classify_postal_code(p_code, set_postalcodes):
+    """ Classifies a postal code in the same groups used by verify_postal_codes
+
+    Args:
+        p_code(str): the value of an addr:postcode tag
+        set_postalcodes(set): valid postal codes returned by get_postalcode_set
+    Returns:
+        group(str): 'invalid', 'in_set', 'not_in_set', 'in_set_cut', 'not_in_set_cut' or 'strange'
+    """
+    if len(p_code) < 4:
+        return 'invalid'
+    elif len(p_code) == 4:
+        return 'in_set' if p_code in set_postalcodes else 'not_in_set'
+    elif len(p_code) == 8:
+        return 'in_set_cut' if p_code[1:5] in set_postalcodes else 'not_in_set_cut'
+    return 'strange'
+
+
+class PostalCodeAuditStage(object):
+    """ Pipeline stage that collects the same sets as verify_postal_codes, one element at a time"""
+
+    def __init__(self, set_postalcodes):
+        self.set_postalcodes = set_postalcodes
+        self.invalid_pc = set()
+        self.in_set_pc = set()
+        self.not_in_set_pc = set()
+        self.not_in_set_cut = []
+        self.strange_pc = set()
+
+    def process(self, element):
+        if element.tag in ELEMENT_TAGS:
+            for tag in element.iter("tag"):
+                if get_postal_code(tag):
+                    self.add(tag.attrib['v'])
+        return element
+
+    def add(self, p_code):
+        group = classify_postal_code(p_code, self.set_postalcodes)
+        if group == 'invalid':
+            self.invalid_pc.add(p_code)
+        elif group == 'in_set':
+            self.in_set_pc.add(p_code)
+        elif group == 'not_in_set':
+            self.not_in_set_pc.add(p_code)
+        elif group == 'in_set_cut':
+            self.in_set_pc.add(p_code[1:5])
+        elif group == 'not_in_set_cut':
+            self.not_in_set_cut.append(p_code[1:5])
+        else:
+            self.strange_pc.add(p_code)
+
+    def finish(self):
+        return self.invalid_pc, self.not_in_set_pc, self.not_in_set_cut, self.strange_pc
+
+
+# The code besides PostalCodeAuditStage that computes the result of verify_postal_codes, part of its cache key
+POSTAL_CODE_AUDIT_CODE = [PostalCodeIndex] + PARSER_CODE
+
+
+def verify_postal_codes(osm, cache=CACHE):
+    """ Audits postal codes from a Buenos Aires osm file, reading it one element at a time with iter_elements
+
+    Args:
+        osm: input Buenos Aires OSM data
+        cache(StageCache): the result is kept in it until the osm file, BA_postalcodes.csv, this module, postal_index
+            or the osm_io readers change, so the file is only read again when one of them does. None to always read it
+    Returns:
+        invalid_pc(set): This set will contain the postal codes whose length is < 4
+        not_in_set_pc(set): Postal codes not found in the set_postalcodes set
+        not_in_set_cut(list): A list containing the postal codes whose length is >4 that were cutted and are not in
+            the set
+        strange_pc(set): Strange postal codes who did not enter in any of the above cases
+        """
+    if cache is not None:
+        return cache.cached('verify_postal_codes', [osm, POSTALCODES_FILE],
+                            [PostalCodeAuditStage] + POSTAL_CODE_AUDIT_CODE, lambda: verify_postal_codes(osm, None))
+    set_postalcodes = get_postalcode_set(POSTALCODES_FILE)
+    stage = PostalCodeAuditStage(set_postalcodes)
+    for element in iter_elements(osm):
+        stage.process(element)
+    invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc = stage.finish()
+    return invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc
+
+
+def get_postal_code(elem):
+    """ Given a tag of a osm file, this returns postal code for a given attribute
+
+    Args:
+        elem(Element)
+    """
+    return elem.attrib['k'] == "addr:postcode"
+
+
+def process_pc_sets(osmfile=OSMFILE, cache=CACHE):
+    """ Individually process the postal codes sets returned from verify_postal_codes"""
+
+    invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc = verify_postal_codes(osmfile, cache)
+
+    """
+    Now I want to study all the postal codes that did not appear in the set_postalcodes to analyze if the codes 
+    actually exist and are missing in the csv file or if those are invalid postal codes.
+    
+    To do this, I'll analyze each of the not_in_set_pc variable and google them to see if I find them:
+    
+    not_in_set_pc {'1720', '0237', '1299', '1404', '1523', '1475', '0000', '1515', '1776', '1522', '1000', 
+    '!923', '1418', '1456', '1423'}
+    
+    - 1776: corresponds to 'localidad 9 de Abril', in Buenos Aires province and this matches with the data in the osm
+    - 1423: does exists, corresponds to a place in 'San Isidro' but in the osm file, this is the only occurrence and does
+    not match with the place it's supposed to be
+    - !923: does not exist
+    - 0237: does not exist
+    - 1418: does not exist
+    - 1456: does not exist
+    - 1299: exists but does not correspond to the place in the osm
+    - 1000: does not exist
+    - 0000: does not exist
+    - 1523: does not exist
+    - 1720: does not exist
+    - 1522: does not exist
+    - 1475: does not exist
+    - 1515: does not exist
+    - 1404: does not exist
+    
+    All of the postal codes that do not exist only appear once in the whole document"""
+
+    """ Analyzing all of the postal codes from strange_pc set:
+    strange_pc {'B1629', '1619, 1623', 'C1439AG', '1170ACG', 'C1006', 'B1663', 'B1631', 'B1702', 'P1091', '1.619', 
+    'C1107', '70000', '1686S', '1425AAJ', 'B1653', 'B1900', '1.852'}
+    
+    All of the postal codes who entered in this set have a length > 4 but < 8 and most of them start with a letter, 
+    which makes me think that they were not entered correctly in openstreetmap, as that notation seems to be a mix 
+    between the old one (only 4-digit numbers) and the new one (8-character postal codes)
+    
+    I'll analyze each of the codes individually:
+     
+    - 1425AAJ -> 1425 -> corresponds to Recoleta, a neighborhood in Buenos Aires 
+    - 70000 does not exist
+    - C1107 -> 1107 -> Juana Manso from 602 to 700, a street in Buenos Aires
+    - B1702 -> 1702 -> Ciudadela and Jose Ingenieros
+    - B1663 -> 1663 -> Muñiz or San Miguel
+    - C1006-> 1006 -> Calle Maipu from 701 to 799 in Buenos Aires.
+    - B1631 -> 1631 -> Localidad Villa Rosa
+    - C1439AG -> 1439 -> Calle Soldado De La Frontera from 5001 to 5099 in Buenos Aires.
+    - 1170ACG -> 1170 -> Calle Dr Tomas De Anchorena, from 501 to 599 
+    - B1653 -> 1653 -> Villa Ballester
+    - P1091 -> 1091 -> Moreno
+    - B1900 -> 1900 -> La Plata
+    - 1.852 -> 1852 -> Ministro Rivadavia or Burzaco
+    - B1629 -> 1629 -> Almirante Irizar, Barrio San Alejo
+    - 1686S -> 1686 -> Hurlingham and William Morris	
+    - '1619, 1623': The actual postal code for that point in the osm is 1625"""
+
+    """From not_in_set_cut:    
+    not_in_set_cut ['anfi', '1652']
+    Neither of the two exist"""
+
+    """ As almost all of the postal codes in strange_pc do exist and the value 70000 is the only one that does not exist,
+    I'm going to move the 70000 element from the strange_pc set to the not_in_setpc so I can later modify all of the
+    remaining postal codes in strange_pc. The POSTCODE_RULES delete it, so every strange code that they delete is
+    moved"""
+    cleaned = POSTCODE_CLEANER.clean_all(strange_pc, get_postal_index(POSTALCODES_FILE))
+    deleted = {p_code for p_code, new_code in cleaned.items() if new_code is None}
+    strange_pc -= deleted
+    invalid_pc |= deleted
+    return invalid_pc, not_in_set_pc, not_in_set_cut, strange_pc
+
+
+def deal_strange_pc(strange_set, postal_index):
+    """Given the results of the analysis of the strange_set, this function modifies each of the postal codes to make
+    them comply with the four-digit format, with the POSTCODE_RULES
+
+    Args:
+        strange_set(set)
+        postal_index(PostalCodeIndex): valid postal codes returned by get_postal_index
+    Returns:
+        strange_dic(dict): the new value of each postal code that is not deleted
+        """
+    cleaned = POSTCODE_CLEANER.clean_all(strange_set, postal_index)
+    return {val: new_val for val, new_val in cleaned.items() if new_val is not None}
+
+
+class PostcodeCleaner(object):
+    """ Applies the POSTCODE_RULES. The patterns are compiled together in a single regular expression, with a named
+    group per rule, so each value is matched once to find its rule whatever the number of rules. The codes are read
+    and validated with the PostalCodeIndex, so the values are normalised in a single place
+
+    Args:
+        rules(list): PostcodeRule, in order
+    """
+
+    def __init__(self, rules=POSTCODE_RULES):
+        self.rules = rules
+        self.patterns = [re.compile(rule.pattern, re.DOTALL) for rule in rules]
+        self.regex = re.compile('|'.join('(?P<rule{0}>{1})'.format(i, rule.pattern) for i, rule in enumerate(rules)),
+                                re.DOTALL)
+
+    def rule(self, p_code):
+        """ Returns the position of the first rule that matches a postal code, or None"""
+        match = self.regex.fullmatch(p_code)
+        return None if match is None else int(match.lastgroup[len('rule'):])
+
+    def clean(self, p_code, postal_index):
+        """ Returns the cleaned postal code, or None if the tag has to be deleted
+
+        Args:
+            p_code(str): the value of an addr:postcode tag
+            postal_index(PostalCodeIndex): valid postal codes returned by get_postal_index
+        """
+        i = self.rule(p_code)
+        if i is None:
+            return None
+        rule = self.rules[i]
+        if rule.result == DELETE:
+            return None
+        if rule.result == KEEP:
+            new_code = p_code
+        elif rule.result == CODE:
+            parsed = postal_index.parse(p_code)
+            if parsed is None:
+                return None
+            new_code = parsed[0]
+        else:
+            new_code = self.patterns[i].fullmatch(p_code).expand(rule.result)
+        if rule.validate and new_code not in postal_index:
+            return None
+        return new_code
+
+    def clean_all(self, p_codes, postal_index):
+        """ Cleans many postal codes, each distinct value once
+
+        Args:
+            p_codes(iterable): values of addr:postcode tags, they can be repeated
+            postal_index(PostalCodeIndex): valid postal codes returned by get_postal_index
+        Returns:
+            cleaned(dict): the cleaned postal code of each distinct value, None for the tags that have to be deleted
+        """
+        return {p_code: self.clean(p_code, postal_index) for p_code in set(p_codes)}
+
+
+POSTCODE_CLEANER = PostcodeCleaner()
+
+
+def clean_postal_code(p_code, postal_index):
+    """ Takes the same decision for a single postal code as the strangepc_dict, invalid_pc and not_in_set_pc
+    returned by audit_postal_codes, so the codes can be cleaned without auditing the whole file first
+
+    Args:
+        p_code(str): the value of an addr:postcode tag
+        postal_index(PostalCodeIndex): valid postal codes returned by get_postal_index
+    Returns:
+        p_code(str): the cleaned postal code or None if the tag has to be deleted
+    """
+    return POSTCODE_CLEANER.clean(p_code, postal_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit the postal codes of an osm file")
+    parser.add_argument('osm_file', nargs='?', default=OSMFILE)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    invalid, not_in_set, not_inset_cut, strange = verify_postal_codes(args.osm_file, cache_from_args(args))
+    print(""" These are the obtained results when the verify_postal_codes function runs, these correspond to the 
+          compilation of sets and lists that later are processed""")
+    print("invalid_pc", invalid)
+    print("not_in_set_pc", not_in_set)
+    print("not_in_set_cut", not_inset_cut)
+    print("strange_pc", strange)
+
+if __name__ == '__main__':
+    main()
+
@@ -1,161 +1,317 @@
-import re
-import xml.etree.cElementTree as ET
-from c_audit_streets import is_street_name
-from e_audit_postal_codes import get_postal_code, audit_postal_codes
-
-STRANGEPC_DICT, INVALID_PC, NOT_IN_SET_PC = audit_postal_codes()
-
-""" From the street types I obtained when I audited the streets (c_audit_streets) I selected the names 
-    that are strange, here they are: 
-    u'ALAMBRADO/PAREDON/LIMITE, Ferrocarril, Super, A, B, Esquina, Per, C, De, D, Audamérica, ' \
-    u'SITIO, E, Grl, ING, Belgrano;25, Payr, 14c, Mir, RP, 624A, PASAJE, Jos, G, DE, H, ' \
-    u'Humberto1。2357, Cno, DIP, Pres, PBRO, J, S, CMTE, Dragones, TGRL, Omb, avenida, Rep, M, BV, ' \
-    u'Av.79, 76-Adelina, 361A, RCA, CJAL, O, Lista, F, Au, Av, P, D73, IGR, DIPUTADO, R, Pi, GDOR, ' \
-    u'av, T, GRAL'
-    
-    Now I'm going to divide the strange names into MAPPING (names that are abbreviated and I'll change for other 
-    names) and STREETS_TO_DELETE (names that are not streets and have a wrong tag)"""
-
-MAPPING = {"CALLE": "Calle", "Avendida": "Avenida", "Av.": "Avenida", "AV": "Avenida", "avenida": "Avenida",
-           "av": "Avenida", "RP": "Ruta Provincial", "Au": "Autopista",
-           "PRES": "Presidente", "Pte": "Presidente", "Pres": "Presidente", "GDOR": "Gobernador",
-           "Rep": "Republica", "GRL": "General", "GRAL": "General", "Grl": "General", "TTE": "Teniente",
-           "TCNL": "Teniente Coronel", "Cno": "Camino", "DIP": "Diputado", "PBRO": "Presbítero",
-           "SGT": "Sargento", "PJE": "Pasaje", "DR": "Doctor", "Dr": "Doctor", "CNL": "Coronel", "CMTE": "Comandante",
-           "Audamérica": "Sudamérica", "P": "Pedro"}
-
-STREETS_TO_DELETE = ["ALAMBRADO/PAREDON/LIMITE PROPIEDAD", "ING TTE DI TELLA", "Belgrano;25 de mayo"]
-
-STREET_TYPE_RE = re.compile(r'^\S+\b', re.IGNORECASE)
-
-
-def process_st_names_and_postalcodes():
-    """ Process the street names and postal codes in a the Buenos Aires data osm file and returns an Element tree
-    object"""
-    process_st_tree = _improve_st_names("buenos-aires_argentina.osm".encode("utf-8"))
-    return _clean_postal_codes(process_st_tree)
-
-
-def _update_name(name):
-    """ Updates the name of a street if the first word is in the MAPPING dictionary
-
-    Args:
-        name(str)
-    Returns:
-        updated_name(str): the updated name if the first word was in the MAPPING dictionary
-    """
-    first_word = STREET_TYPE_RE.search(name)
-    if first_word:
-        st_type = first_word.group()
-        if st_type in MAPPING:
-            expected_st = MAPPING[st_type]
-            updated_name = re.sub(STREET_TYPE_RE, expected_st, name)
-            return updated_name
-    return
-
-
-def _improve_st_names(osmfile):
-    """ Changes the street names to a format given in MAPPING and deletes the streets that are not actually streets and
-    have the street tag by mistake
-
-    Args:
-        osmfile
-    Returns:
-        tree(Element)
-        """
-    tree = ET.parse(osmfile)
-    root = tree.getroot()
-    for child in root:
-        if child.tag == "node" or child.tag == "way":
-            for tag in child.iter("tag"):
-                if is_street_name(tag):
-                    updatename = _update_name(tag.attrib['v'])
-                    if updatename:
-                        tag.set('v', updatename)
-                    elif tag.attrib['v'] in STREETS_TO_DELETE:
-                        root.remove(child)
-    return tree
-
-
-def _verify_replaced_streets(tree):
-    """ Verifies if the street names were replaced correctly.
-
-    Args:
-    tree(Element): should be a tree that has been returned from _improve_st_names function"""
-    root = tree.getroot()
-    for child in root:
-        if child.tag == "node" or child.tag == "way":
-            for tag in child.iter("tag"):
-                if is_street_name(tag) and _update_name(tag.attrib['v']):
-                    print(u"This word was not replaced: ", tag.attrib)
-    print("All words were replaced")
-
-
-def _verify_deleted_nodes(tree):
-    """ Verifies if the nodes were deleted correctly.
-
-    Args:
-    tree(Element): should be a tree that has been returned from _improve_st_names function
-    """
-    root = tree.getroot()
-    for child in root:
-        if child.tag == "node" or child.tag == "way":
-            for tag in child.iter("tag"):
-                if tag.attrib['v'] in STREETS_TO_DELETE:
-                    print(u"This node was not deleted: ", tag.attrib)
-    print("All nodes were deleted")
-
-
-""" POSTAL CODES """
-
-
-def _clean_postal_codes(tree):
-    """ Deletes the node of the postal codes that are incorrect and changes the postal codes that are do exist
-    but are not written correctly in the osm file
-
-    Args:
-        tree(Element)
-    Returns:
-        tree(Element)
-    """
-    root = tree.getroot()
-    for child in root:
-        if child.tag == "node":
-            for tag in child.iter("tag"):
-                if get_postal_code(tag):
-                    p_code = tag.attrib['v']
-                    if p_code in STRANGEPC_DICT:
-                        tag.set('v', STRANGEPC_DICT[p_code])
-                    elif p_code in INVALID_PC or p_code in NOT_IN_SET_PC:
-                        child.remove(tag)
-    return tree
-
-
-def _verify_postal_codes(tree):
-    """ Verifies if the postal codes were deleted and replaced correctly.
-
-    Args:
-        tree(Element): should be a tree that has been returned from the _clean_postal_codes function
-        """
-    root = tree.getroot()
-    for child in root:
-        if child.tag == "node":
-            for tag in child.iter("tag"):
-                if get_postal_code(tag):
-                    p_code = tag.attrib['v']
-                    if p_code in STRANGEPC_DICT:
-                        if p_code != '1776':
-                            print(u"This post code was not replaced: ", tag.attrib)
-                    elif p_code in INVALID_PC or p_code in NOT_IN_SET_PC:
-                        print(u"This post code was not deleted: ", tag.attrib)
-    print("All postal codes were replaced/deleted")
-
-
-def main():
-    validate_tree = process_st_names_and_postalcodes()
-    _verify_replaced_streets(validate_tree)
-    _verify_deleted_nodes(validate_tree)
-    _verify_postal_codes(validate_tree)
-
-if __name__ == '__main__':
-    main()
+import argparse
+import re
+from functools import lru_cache, partial
+from osm_io import iter_elements, ELEMENT_TAGS
+from c_audit_streets import is_street_name
+from e_audit_postal_codes import get_postal_code, audit_postal_codes, clean_postal_code, get_postal_index, \
+    POSTALCODES_FILE
+
+""" From the street types I obtained when I audited the streets (c_audit_streets) I selected the names 
+    that are strange, here they are: 
+    u'ALAMBRADO/PAREDON/LIMITE, Ferrocarril, Super, A, B, Esquina, Per, C, De, D, Audamérica, ' \
+    u'SITIO, E, Grl, ING, Belgrano;25, Payr, 14c, Mir, RP, 624A, PASAJE, Jos, G, DE, H, ' \
+    u'Humberto1。2357, Cno, DIP, Pres, PBRO, J, S, CMTE, Dragones, TGRL, Omb, avenida, Rep, M, BV, ' \
+    u'Av.79, 76-Adelina, 361A, RCA, CJAL, O, Lista, F, Au, Av, P, D73, IGR, DIPUTADO, R, Pi, GDOR, ' \
+    u'av, T, GRAL'
+    
+    Now I'm going to divide the strange names into MAPPING (names that are abbreviated and I'll change for other 
+    names) and STREETS_TO_DELETE (names that are not streets and have a wrong tag)"""
+
+MAPPING = {"CALLE": "Calle", "Avendida": "Avenida", "Av.": "Avenida", "AV": "Avenida", "avenida": "Avenida",
+           "av": "Avenida", "RP": "Ruta Provincial", "Au": "Autopista",
+           "PRES": "Presidente", "Pte": "Presidente", "Pres": "Presidente", "GDOR": "Gobernador",
+           "Rep": "Republica", "GRL": "General", "GRAL": "General", "Grl": "General", "TTE": "Teniente",
+           "TCNL": "Teniente Coronel", "Cno": "Camino", "DIP": "Diputado", "PBRO": "Presbítero",
+           "SGT": "Sargento", "PJE": "Pasaje", "DR": "Doctor", "Dr": "Doctor", "CNL": "Coronel", "CMTE": "Comandante",
+           "Audamérica": "Sudamérica", "P": "Pedro"}
+
+STREETS_TO_DELETE = ["ALAMBRADO/PAREDON/LIMITE PROPIEDAD", "ING TTE DI TELLA", "Belgrano;25 de mayo"]
+
+TOKEN_RE = re.compile(r'\S+')
+# The start of a word up to its last word boundary, it drops the punctuation after an abbreviation like "Dr."
+TRIMMED_RE = re.compile(r'\S+\b')
+
+OSMFILE = "buenos-aires_argentina.osm"
+
+
+@lru_cache(maxsize=None)
+def get_postal_code_audit(osmfile=OSMFILE):
+    """ Runs audit_postal_codes the first time it is called for an osm file. Its sets are also kept on disk by
+    stage_cache, so later runs do not read the osm file again while it does not change
+
+    Returns:
+        strangepc_dict(dict), invalid_pc(set), not_in_set_pc(set): see audit_postal_codes
+    """
+    return audit_postal_codes(osmfile)
+
+
+def process_st_names_and_postalcodes(osmfile=OSMFILE):
+    """ Process the street names and postal codes in a the Buenos Aires data osm file with the results of the postal
+    codes audit, and yields the cleaned elements one at a time"""
+    return _clean_postal_codes(_improve_st_names(osmfile), osmfile)
+
+
+def stream_st_names_and_postalcodes(osmfile=OSMFILE, tags=ELEMENT_TAGS, postal_index=None):
+    """ Streaming version of process_st_names_and_postalcodes. The osm file is read with iterparse and each top level
+    element is cleaned, yielded and then freed, so the memory used does not depend on the size of the file.
+
+    Args:
+        osmfile(str): name of the osm file, an xml file that can be compressed or a .osm.pbf file
+        tags(tuple): top level tags to yield
+        postal_index(PostalCodeIndex): valid postal codes, the index of BA_postalcodes.csv by default
+    Yields:
+        element(Element): cleaned node, way or relation, the elements that have to be deleted are not yielded
+    """
+    if postal_index is None:
+        postal_index = get_postal_index(POSTALCODES_FILE)
+    cleaning = CleaningStage(postal_index)
+    for elem in iter_elements(osmfile, tags):
+        cleaned = cleaning.process(elem)
+        if cleaned is not None:
+            yield cleaned
+
+
+def clean_element(element, fix_postal_code=None, osmfile=OSMFILE):
+    """ Applies the same rules as _improve_st_names and _clean_postal_codes to a single element
+
+    Args:
+        element(Element): a node, a way or a relation
+        fix_postal_code(function): takes a postal code and returns the cleaned one or None if the tag has to be
+            deleted. By default the results of audit_postal_codes of osmfile are used
+        osmfile(str): the osm file the element was read from
+    Returns:
+        element(Element): the cleaned element or None if the element has to be deleted
+    """
+    if fix_postal_code is None:
+        fix_postal_code = partial(_fix_postal_code, osmfile=osmfile)
+    for tag in element.iter("tag"):
+        if is_street_name(tag):
+            updatename = _update_name(tag.attrib['v'])
+            if updatename:
+                tag.set('v', updatename)
+            elif tag.attrib['v'] in STREETS_TO_DELETE:
+                return None
+    for tag in list(element.iter("tag")):
+        if get_postal_code(tag):
+            p_code = fix_postal_code(tag.attrib['v'])
+            if p_code is None:
+                element.remove(tag)
+            else:
+                tag.set('v', p_code)
+    return element
+
+
+def _fix_postal_code(p_code, osmfile=OSMFILE):
+    """ Cleans a postal code with the strangepc_dict, invalid_pc and not_in_set_pc obtained in the audit of osmfile"""
+    strangepc_dict, invalid_pc, not_in_set_pc = get_postal_code_audit(osmfile)
+    if p_code in strangepc_dict:
+        return strangepc_dict[p_code]
+    elif p_code in invalid_pc or p_code in not_in_set_pc:
+        return None
+    return p_code
+
+
+class CleaningStage(object):
+    """ Pipeline stage that cleans each element with clean_element. The postal codes are cleaned one by one with
+    e_audit_postal_codes.clean_postal_code, so the postal codes audit does not need to run before
+
+    Args:
+        postal_index(PostalCodeIndex): valid postal codes returned by get_postal_index
+    """
+
+    def __init__(self, postal_index):
+        self.postal_index = postal_index
+        self.fixed_pc = {}  # The same postal codes are repeated in many elements
+        self.deleted = 0
+
+    def fix_postal_code(self, p_code):
+        if p_code not in self.fixed_pc:
+            self.fixed_pc[p_code] = clean_postal_code(p_code, self.postal_index)
+        return self.fixed_pc[p_code]
+
+    def process(self, element):
+        if element.tag in ELEMENT_TAGS:
+            element = clean_element(element, self.fix_postal_code)
+            if element is None:
+                self.deleted += 1
+        return element
+
+    def finish(self):
+        return self.deleted
+
+
+class StreetNameNormaliser(object):
+    """ Changes the first words of street names with a mapping like MAPPING. The keys of the mapping are compiled in
+    a trie of words, so a key can have more than one word ("ING TTE") and the longest key that matches is used.
+
+    Words are compared ignoring case, so "AV", "Av" and "av" are the same key, except one-letter keys like "P" that
+    have to match exactly. A word that is not a key is looked up again without its trailing punctuation, so "Dr." and
+    "Pte." match "Dr" and "Pte". The results are memoised, as a few streets account for most of the street tags.
+
+    Args:
+        mapping(dict): abbreviation -> full name
+        cache_size(int): number of street names whose result is kept
+    """
+
+    _END = object()  # marks the trie nodes where a key ends
+
+    def __init__(self, mapping, cache_size=65536):
+        self.trie = {}
+        for abbreviation, full_name in mapping.items():
+            node = self.trie
+            for word in abbreviation.split():
+                node = node.setdefault(self._fold(word), {})
+            if node.get(self._END, full_name) != full_name:
+                raise ValueError("{0!r} maps to different names when the case is ignored".format(abbreviation))
+            node[self._END] = full_name
+        self.normalise = lru_cache(maxsize=cache_size)(self._normalise)
+
+    @staticmethod
+    def _fold(word):
+        return word if len(word) == 1 else word.casefold()
+
+    def _normalise(self, name):
+        """ Returns the updated name, or None if no key matches or the name does not change"""
+        node = self.trie
+        match = None
+        for word in TOKEN_RE.finditer(name):
+            child = node.get(self._fold(word.group()))
+            end = word.end()
+            if child is None:  # "Dr." is looked up as "Dr", and the dot is kept after the full name
+                trimmed = TRIMMED_RE.match(word.group())
+                if trimmed is not None and trimmed.end() < len(word.group()):
+                    child = node.get(self._fold(trimmed.group()))
+                    end = word.start() + trimmed.end()
+            if child is None:
+                break
+            node = child
+            if self._END in node:
+                match = (node[self._END], end)
+        if match is None:
+            return None
+        full_name, end = match
+        updated_name = full_name + name[end:]
+        return updated_name if updated_name != name else None
+
+    def stats(self):
+        """ Returns the hits, misses and number of street names in the cache"""
+        info = self.normalise.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'cached': info.currsize}
+
+
+NORMALISER = StreetNameNormaliser(MAPPING)
+
+
+def _update_name(name):
+    """ Updates the name of a street if the first words are in the MAPPING dictionary
+
+    Args:
+        name(str)
+    Returns:
+        updated_name(str): the updated name if the first words were in the MAPPING dictionary
+    """
+    return NORMALISER.normalise(name)
+
+
+def _improve_st_names(osmfile):
+    """ Changes the street names to a format given in MAPPING and deletes the streets that are not actually streets and
+    have the street tag by mistake. The osm file is read with iter_elements, so each element is freed once the next
+    one is read
+
+    Args:
+        osmfile(str): name of the osm file
+    Yields:
+        element(Element): the nodes, ways and relations that are not deleted
+        """
+    for child in iter_elements(osmfile):
+        deleted = False
+        for tag in child.iter("tag"):
+            if is_street_name(tag):
+                updatename = _update_name(tag.attrib['v'])
+                if updatename:
+                    tag.set('v', updatename)
+                elif tag.attrib['v'] in STREETS_TO_DELETE:
+                    deleted = True
+        if not deleted:
+            yield child
+
+
+def _verify_replaced_streets(element):
+    """ Verifies if the street names of an element were replaced correctly.
+
+    Args:
+    element(Element): should be an element that has been yielded from the _improve_st_names function"""
+    for tag in element.iter("tag"):
+        if is_street_name(tag) and _update_name(tag.attrib['v']):
+            print(u"This word was not replaced: ", tag.attrib)
+
+
+def _verify_deleted_nodes(element):
+    """ Verifies if an element that had to be deleted was deleted correctly.
+
+    Args:
+    element(Element): should be an element that has been yielded from the _improve_st_names function
+    """
+    for tag in element.iter("tag"):
+        if tag.attrib['v'] in STREETS_TO_DELETE:
+            print(u"This node was not deleted: ", tag.attrib)
+
+
+""" POSTAL CODES """
+
+
+def _clean_postal_codes(elements, osmfile=OSMFILE):
+    """ Deletes the node of the postal codes that are incorrect and changes the postal codes that are do exist
+    but are not written correctly in the osm file
+
+    Args:
+        elements(iterable): the elements yielded by _improve_st_names
+        osmfile(str): the osm file that was audited to get the postal codes to change or delete
+    Yields:
+        element(Element)
+    """
+    strangepc_dict, invalid_pc, not_in_set_pc = get_postal_code_audit(osmfile)
+    for child in elements:
+        for tag in list(child.iter("tag")):
+            if get_postal_code(tag):
+                p_code = tag.attrib['v']
+                if p_code in strangepc_dict:
+                    tag.set('v', strangepc_dict[p_code])
+                elif p_code in invalid_pc or p_code in not_in_set_pc:
+                    child.remove(tag)
+        yield child
+
+
+def _verify_postal_codes(element, osmfile=OSMFILE):
+    """ Verifies if the postal codes of an element were deleted and replaced correctly.
+
+    Args:
+        element(Element): should be an element that has been yielded from the _clean_postal_codes function
+        osmfile(str): the osm file that was audited to get the postal codes to change or delete
+        """
+    strangepc_dict, invalid_pc, not_in_set_pc = get_postal_code_audit(osmfile)
+    for tag in element.iter("tag"):
+        if get_postal_code(tag):
+            p_code = tag.attrib['v']
+            if p_code in strangepc_dict:
+                if p_code != '1776':
+                    print(u"This post code was not replaced: ", tag.attrib)
+            elif p_code in invalid_pc or p_code in not_in_set_pc:
+                print(u"This post code was not deleted: ", tag.attrib)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean the street names and postal codes of an osm file and verify "
+                                                 "the results")
+    parser.add_argument('osm_file', nargs='?', default=OSMFILE)
+    args = parser.parse_args()
+    for element in process_st_names_and_postalcodes(args.osm_file):
+        _verify_replaced_streets(element)
+        _verify_deleted_nodes(element)
+        _verify_postal_codes(element, args.osm_file)
+    print("All words were replaced")
+    print("All nodes were deleted")
+    print("All postal codes were replaced/deleted")
+
+if __name__ == '__main__':
+    main()
@@ -1,205 +1,739 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-
-from f_clean_osm_data import process_st_names_and_postalcodes
-import unicodecsv as csv
-import codecs
-import pprint
-import re
-import cerberus
-import schema
-
-cleaned_data_tree = process_st_names_and_postalcodes()
-NODES_PATH = "nodes.csv"
-NODE_TAGS_PATH = "nodes_tags.csv"
-WAYS_PATH = "ways.csv"
-WAY_NODES_PATH = "ways_nodes.csv"
-WAY_TAGS_PATH = "ways_tags.csv"
-
-LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
-PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
-
-SCHEMA = schema.schema
-
-# Making sure the fields order in the csvs matches the column order in the sql table schema
-NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
-NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
-WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_NODES_FIELDS = ['id', 'node_id', 'position']
-
-
-# Part of my code
-
-def find_colons(input_string):
-    """ Finds a colon in a string"""
-    return [x.start() for x in re.finditer('\:', input_string)]
-
-
-def create_nodes(element, node_fields, node_tags_fields, now):
-    """ Creates nodes to be exported then to a csv file.
-
-    Args:
-        element(Element)
-        node_fields(list): containing the nodes fields in the correct order
-        node_tags_fields(list): containing the nodes tags fields in the correct order
-        now(str): defining if a node or a way is being created
-
-    Returns:
-        node_dict(dict)
-        """
-    node_dict = {now: {}}
-    for f in node_fields:
-        node_dict[now][f] = element.attrib[f]
-    node_dict[now + '_tags'] = []
-    root_attr = element.attrib
-    for child in element:
-        if child.tag == 'tag':
-            child_attr = child.attrib
-            k = child_attr['k']
-            if PROBLEMCHARS.search(k) is None:
-                tag_fields = {}
-                colons_positions = find_colons(k)
-                if len(colons_positions) >= 1:
-                    tag_fields['type'] = k[:colons_positions[0]]
-                    tag_fields['key'] = k[colons_positions[0] + 1:]
-                else:
-                    tag_fields['type'] = 'regular'
-                    tag_fields['key'] = k
-                tag_fields['value'] = child_attr['v']
-                tag_fields['id'] = root_attr['id']
-            node_dict[now + '_tags'].append(tag_fields)
-    return node_dict
-
-
-def create_ways(element, way_fields, way_tags_fields, now):
-    """ Creates ways to be exported then to a csv file.
-
-    Args:
-        element(Element)
-        node_fields(list): containing the ways fields in the correct order
-        node_tags_fields(list): containing the ways tags fields in the correct order
-        now(str): defining if a node or a way is being created
-
-    Returns:
-        ways_dict(dict)
-    """
-    ways_dict = create_nodes(element, way_fields, way_tags_fields, now)
-
-    ways_dict['way_nodes'] = []
-    root_attr = element.attrib
-    counter = 0
-    for child in element:
-        if child.tag == 'nd':
-            child_attr = child.attrib
-            tag_fields = {}
-            tag_fields['id'] = root_attr['id']
-            tag_fields['node_id'] = child_attr['ref']
-            tag_fields['position'] = counter
-            ways_dict['way_nodes'].append(tag_fields)
-            counter += 1
-    return ways_dict
-
-
-""" The code below was provided by Udacity - Case Study: OpenStreetMap data (SQL)"""
-
-
-def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-    """Clean and shape node or way XML element to Python dict"""
-
-    node_attribs = {}
-    way_attribs = {}
-    way_nodes = []
-    tags = []  # Handle secondary tags the same way for both node and way elements
-
-    if element.tag == 'node':
-        return create_nodes(element, NODE_FIELDS, NODE_TAGS_FIELDS, 'node')
-    elif element.tag == 'way':
-        return create_ways(element, WAY_FIELDS, WAY_TAGS_FIELDS, 'way')
-
-
-""" The code below was provided by Udacity - Case Study: OpenStreetMap data (SQL)"""
-# ================================================== #
-#               Helper Functions                     #
-# ================================================== #
-
-def get_element(input_tree, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
-    root = input_tree.getroot()
-    for child in root:
-        if child.tag in tags:
-            yield child
-
-
-def validate_element(element, validator, schema=SCHEMA):
-    """Raise ValidationError if element does not match schema"""
-    if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
-        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
-        error_string = pprint.pformat(errors)
-
-        raise Exception(message_string.format(field, error_string))
-
-
-class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
-
-    def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-            k: (v.encode('utf-8') if isinstance(v, str) else v) for k, v in row.items()
-        })
-
-    def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
-
-
-""" Part of the code below was provided by Udacity - Case Study: OpenStreetMap data (SQL)"""
-
-# ================================================== #
-#               Main Function                        #
-# ================================================== #
-def process_map(input_tree, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-
-    with codecs.open(NODES_PATH, 'wb') as nodes_file, \
-            codecs.open(NODE_TAGS_PATH, 'wb') as nodes_tags_file, \
-            codecs.open(WAYS_PATH, 'wb') as ways_file, \
-            codecs.open(WAY_NODES_PATH, 'wb') as way_nodes_file, \
-            codecs.open(WAY_TAGS_PATH, 'wb') as way_tags_file:
-
-        nodes_writer = csv.DictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = csv.DictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = csv.DictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = csv.DictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = csv.DictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(input_tree, tags=('node', 'way')):
-            el = shape_element(element)
-            if el:
-                if validate is True:
-                    validate_element(el, validator)
-
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
-
-
-if __name__ == '__main__':
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
-    process_map(cleaned_data_tree, validate=False)
-    # process_map("small_sample.osm", validate=True)
\ No newline at end of file
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from f_clean_osm_data import stream_st_names_and_postalcodes, CleaningStage, OSMFILE
+from e_audit_postal_codes import get_postal_index, POSTALCODES_FILE
+from h_create_db import SqliteWriter, ELEMENT_PARTS
+from j_write_parquet import ParquetWriter
+from osm_io import is_compressed, is_pbf
+from node_store import CoordinateIndexWriter, way_geometry, NODE_INDEX_FILE
+from schema_validator import CompiledValidator, ValidationSample, ValidationReport
+import argparse
+import unicodecsv as csv
+import codecs
+from functools import lru_cache
+import csv as text_csv
+import heapq
+import time
+from operator import itemgetter
+import multiprocessing
+import os
+import pprint
+import re
+import shutil
+import tempfile
+import xml.etree.cElementTree as ET
+import schema
+
+NODES_PATH = "nodes.csv"
+NODE_TAGS_PATH = "nodes_tags.csv"
+WAYS_PATH = "ways.csv"
+WAY_NODES_PATH = "ways_nodes.csv"
+WAY_TAGS_PATH = "ways_tags.csv"
+WAY_GEOMETRY_PATH = "ways_geometry.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_MEMBERS_PATH = "relations_members.csv"
+RELATION_TAGS_PATH = "relations_tags.csv"
+
+LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+SCHEMA = schema.schema
+
+# Making sure the fields order in the csvs matches the column order in the sql table schema
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+WAY_GEOMETRY_FIELDS = ['id', 'length', 'min_lat', 'min_lon', 'max_lat', 'max_lon', 'centroid_lat', 'centroid_lon',
+                       'missing_nodes']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'member_type', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+
+CSV_FILES = [(NODES_PATH, NODE_FIELDS),
+             (NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+             (WAYS_PATH, WAY_FIELDS),
+             (WAY_NODES_PATH, WAY_NODES_FIELDS),
+             (WAY_TAGS_PATH, WAY_TAGS_FIELDS),
+             (RELATIONS_PATH, RELATION_FIELDS),
+             (RELATION_MEMBERS_PATH, RELATION_MEMBERS_FIELDS),
+             (RELATION_TAGS_PATH, RELATION_TAGS_FIELDS)]
+
+# Part of a shaped element written to each csv file
+CSV_PARTS = [('node', NODES_PATH, NODE_FIELDS),
+             ('node_tags', NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+             ('way', WAYS_PATH, WAY_FIELDS),
+             ('way_nodes', WAY_NODES_PATH, WAY_NODES_FIELDS),
+             ('way_tags', WAY_TAGS_PATH, WAY_TAGS_FIELDS),
+             ('way_geometry', WAY_GEOMETRY_PATH, WAY_GEOMETRY_FIELDS),
+             ('relation', RELATIONS_PATH, RELATION_FIELDS),
+             ('relation_members', RELATION_MEMBERS_PATH, RELATION_MEMBERS_FIELDS),
+             ('relation_tags', RELATION_TAGS_PATH, RELATION_TAGS_FIELDS)]
+
+# Start of a top level element, used to split the osm file in shards
+TOP_LEVEL_RE = re.compile(rb'<(node|way|relation)[\s/>]')
+
+
+# Part of my code
+
+class TagKeyClassifier(object):
+    """ Splits the tag keys in type and key, like 'addr:street' -> ('addr', 'street') and 'name' -> ('regular',
+    'name'), and marks the keys with problem chars. The same few keys are used in most of the tags, so the result
+    of each key is memoised and shaping a tag is usually a dict lookup.
+
+    Args:
+        problem_chars(Pattern): the keys that match it are problematic
+        default_tag_type(str): type of the keys without a colon
+        cache_size(int): number of keys whose result is kept
+    """
+
+    def __init__(self, problem_chars=PROBLEMCHARS, default_tag_type='regular', cache_size=65536):
+        self.problem_chars = problem_chars
+        self.default_tag_type = default_tag_type
+        self.problematic_misses = 0  # a key evicted from the cache is classified, and counted, again
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, k):
+        """ Returns (type, key, is_problematic) for a tag key"""
+        if self.problem_chars.search(k) is not None:
+            self.problematic_misses += 1
+            return None, None, True
+        tag_type, colon, key = k.partition(':')
+        if not colon:
+            return self.default_tag_type, k, False
+        return tag_type, key, False
+
+    def stats(self):
+        """ Returns the hits, misses and number of keys in the cache, and how many misses were problematic keys"""
+        info = self.classify.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'cached': info.currsize,
+                'problematic_misses': self.problematic_misses}
+
+
+KEY_CLASSIFIER = TagKeyClassifier()
+
+
+def create_nodes(element, node_fields, node_tags_fields, now):
+    """ Creates nodes to be exported then to a csv file.
+
+    Args:
+        element(Element)
+        node_fields(list): containing the nodes fields in the correct order
+        node_tags_fields(list): containing the nodes tags fields in the correct order
+        now(str): defining if a node or a way is being created
+
+    Returns:
+        node_dict(dict)
+        """
+    node_dict = {now: {}}
+    for f in node_fields:
+        node_dict[now][f] = element.attrib[f]
+    node_dict[now + '_tags'] = []
+    root_attr = element.attrib
+    classify = KEY_CLASSIFIER.classify
+    for child in element:
+        if child.tag == 'tag':
+            child_attr = child.attrib
+            tag_type, key, is_problematic = classify(child_attr['k'])
+            if is_problematic:  # the tags with problem chars in the key are ignored
+                continue
+            node_dict[now + '_tags'].append({'id': root_attr['id'], 'key': key, 'value': child_attr['v'],
+                                             'type': tag_type})
+    return node_dict
+
+
+def create_ways(element, way_fields, way_tags_fields, now, coordinate_index=None):
+    """ Creates ways to be exported then to a csv file.
+
+    Args:
+        element(Element)
+        node_fields(list): containing the ways fields in the correct order
+        node_tags_fields(list): containing the ways tags fields in the correct order
+        now(str): defining if a node or a way is being created
+        coordinate_index(CoordinateIndex): if given, the node refs are resolved to coordinates and the length,
+            bounding box and centroid of the way are added as 'way_geometry'
+
+    Returns:
+        ways_dict(dict)
+    """
+    ways_dict = create_nodes(element, way_fields, way_tags_fields, now)
+
+    ways_dict['way_nodes'] = []
+    root_attr = element.attrib
+    counter = 0
+    for child in element:
+        if child.tag == 'nd':
+            child_attr = child.attrib
+            tag_fields = {}
+            tag_fields['id'] = root_attr['id']
+            tag_fields['node_id'] = child_attr['ref']
+            tag_fields['position'] = counter
+            ways_dict['way_nodes'].append(tag_fields)
+            counter += 1
+    if coordinate_index is not None:
+        lats, lons, missing = coordinate_index.coordinates([int(nd['node_id']) for nd in ways_dict['way_nodes']])
+        geometry = way_geometry(lats, lons)
+        if geometry is not None:
+            geometry['id'] = root_attr['id']
+            geometry['missing_nodes'] = missing
+            ways_dict['way_geometry'] = geometry
+    return ways_dict
+
+
+def create_relations(element):
+    """ Creates relations to be exported then to a csv file, with their members in order
+
+    Args:
+        element(Element)
+
+    Returns:
+        relations_dict(dict)
+    """
+    relations_dict = create_nodes(element, RELATION_FIELDS, RELATION_TAGS_FIELDS, 'relation')
+    relations_dict['relation_members'] = []
+    relation_id = element.attrib['id']
+    position = 0
+    for child in element:
+        if child.tag == 'member':
+            child_attr = child.attrib
+            relations_dict['relation_members'].append({'id': relation_id, 'member_id': child_attr['ref'],
+                                                       'member_type': child_attr['type'],
+                                                       'role': child_attr['role'], 'position': position})
+            position += 1
+    return relations_dict
+
+
+""" The code below was provided by Udacity - Case Study: OpenStreetMap data (SQL)"""
+
+
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular', coordinate_index=None):
+    """Clean and shape node, way or relation XML element to Python dict"""
+
+    node_attribs = {}
+    way_attribs = {}
+    way_nodes = []
+    tags = []  # Handle secondary tags the same way for both node and way elements
+
+    if element.tag == 'node':
+        return create_nodes(element, NODE_FIELDS, NODE_TAGS_FIELDS, 'node')
+    elif element.tag == 'way':
+        return create_ways(element, WAY_FIELDS, WAY_TAGS_FIELDS, 'way', coordinate_index)
+    elif element.tag == 'relation':
+        return create_relations(element)
+
+
+""" The code below was provided by Udacity - Case Study: OpenStreetMap data (SQL)"""
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+
+def get_element(input_tree, tags=('node', 'way', 'relation')):
+    """Yield element if it is the right type of tag
+
+    input_tree can be an ElementTree or an iterable of elements, like the one returned by
+    f_clean_osm_data.stream_st_names_and_postalcodes"""
+    if hasattr(input_tree, 'getroot'):
+        input_tree = input_tree.getroot()
+    for child in input_tree:
+        if child.tag in tags:
+            yield child
+
+
+def validate_element(element, validator, schema=SCHEMA):
+    """Raise ValidationError if element does not match schema
+
+    validator can be a schema_validator.CompiledValidator or a cerberus.Validator, they report the same errors"""
+    if validator.validate(element, schema) is not True:
+        field, errors = next(iter(validator.errors.items()))
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_string = pprint.pformat(errors)
+
+        raise Exception(message_string.format(field, error_string))
+
+
+class UnicodeDictWriter(csv.DictWriter, object):
+    """Extend csv.DictWriter to handle Unicode input"""
+
+    def writerow(self, row):
+        super(UnicodeDictWriter, self).writerow({
+            k: (v.encode('utf-8') if isinstance(v, str) else v) for k, v in row.items()
+        })
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+class CsvWriter(object):
+    """ Writes the shaped elements to the nodes, ways and relations csv files and the csv files of their tags, ways
+    nodes and relations members, with the csv module of the standard library in text mode. The rows of each file are
+    converted to tuples in the order of its fields and buffered, and the buffers are written with one writerows call
+    every batch_size elements.
+
+    The files are the same as the ones written by DictCsvWriter, only faster.
+
+    Args:
+        output_dir(str): directory where the csv files are written
+        geometry(bool): also write the ways geometry csv file
+        batch_size(int): number of elements buffered before the rows are written
+        buffer_size(int): size in bytes of the buffer of each file
+    """
+
+    def __init__(self, output_dir='.', geometry=False, batch_size=10000, buffer_size=1 << 20):
+        parts = CSV_PARTS if geometry else [p for p in CSV_PARTS if p[0] != 'way_geometry']
+        self.files = []
+        self.writers = {}
+        self.rows = {}
+        self.getters = {}
+        for part, path, fields in parts:
+            f = open(os.path.join(output_dir, path), 'w', encoding='utf8', newline='', buffering=buffer_size)
+            writer = text_csv.writer(f)
+            writer.writerow(fields)
+            self.files.append(f)
+            self.writers[part] = writer
+            self.rows[part] = []
+            self.getters[part] = itemgetter(*fields)
+        self.batch_size = batch_size
+        self.buffered = 0
+
+    def write(self, element_type, el):
+        """ Buffers an element returned by shape_element
+
+        Args:
+            element_type(str): 'node', 'way' or 'relation'
+            el(dict): the shaped element
+        """
+        for part in ELEMENT_PARTS[element_type]:
+            if part in el and part in self.rows:
+                value = el[part]
+                if isinstance(value, dict):
+                    self.rows[part].append(self.getters[part](value))
+                else:
+                    self.rows[part].extend(map(self.getters[part], value))
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered rows"""
+        for part, rows in self.rows.items():
+            if rows:
+                self.writers[part].writerows(rows)
+                self.rows[part] = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+
+
+class DictCsvWriter(object):
+    """ Writes the shaped elements to the csv files with one unicodecsv.DictWriter call per row. It is the writer
+    CsvWriter replaced, and is kept to compare them with benchmark_writers
+
+    Args:
+        output_dir(str): directory where the csv files are written
+        geometry(bool): also write the ways geometry csv file
+    """
+
+    def __init__(self, output_dir='.', geometry=False):
+        self.nodes_file = codecs.open(os.path.join(output_dir, NODES_PATH), 'wb')
+        self.nodes_tags_file = codecs.open(os.path.join(output_dir, NODE_TAGS_PATH), 'wb')
+        self.ways_file = codecs.open(os.path.join(output_dir, WAYS_PATH), 'wb')
+        self.way_nodes_file = codecs.open(os.path.join(output_dir, WAY_NODES_PATH), 'wb')
+        self.way_tags_file = codecs.open(os.path.join(output_dir, WAY_TAGS_PATH), 'wb')
+        self.relations_file = codecs.open(os.path.join(output_dir, RELATIONS_PATH), 'wb')
+        self.relation_members_file = codecs.open(os.path.join(output_dir, RELATION_MEMBERS_PATH), 'wb')
+        self.relation_tags_file = codecs.open(os.path.join(output_dir, RELATION_TAGS_PATH), 'wb')
+
+        self.nodes_writer = csv.DictWriter(self.nodes_file, NODE_FIELDS)
+        self.node_tags_writer = csv.DictWriter(self.nodes_tags_file, NODE_TAGS_FIELDS)
+        self.ways_writer = csv.DictWriter(self.ways_file, WAY_FIELDS)
+        self.way_nodes_writer = csv.DictWriter(self.way_nodes_file, WAY_NODES_FIELDS)
+        self.way_tags_writer = csv.DictWriter(self.way_tags_file, WAY_TAGS_FIELDS)
+        self.relations_writer = csv.DictWriter(self.relations_file, RELATION_FIELDS)
+        self.relation_members_writer = csv.DictWriter(self.relation_members_file, RELATION_MEMBERS_FIELDS)
+        self.relation_tags_writer = csv.DictWriter(self.relation_tags_file, RELATION_TAGS_FIELDS)
+
+        self.nodes_writer.writeheader()
+        self.node_tags_writer.writeheader()
+        self.ways_writer.writeheader()
+        self.way_nodes_writer.writeheader()
+        self.way_tags_writer.writeheader()
+        self.relations_writer.writeheader()
+        self.relation_members_writer.writeheader()
+        self.relation_tags_writer.writeheader()
+
+        self.way_geometry_file = None
+        if geometry:
+            self.way_geometry_file = codecs.open(os.path.join(output_dir, WAY_GEOMETRY_PATH), 'wb')
+            self.way_geometry_writer = csv.DictWriter(self.way_geometry_file, WAY_GEOMETRY_FIELDS)
+            self.way_geometry_writer.writeheader()
+
+    def write(self, element_type, el):
+        """ Writes an element returned by shape_element
+
+        Args:
+            element_type(str): 'node', 'way' or 'relation'
+            el(dict): the shaped element
+        """
+        if element_type == 'node':
+            self.nodes_writer.writerow(el['node'])
+            self.node_tags_writer.writerows(el['node_tags'])
+        elif element_type == 'way':
+            self.ways_writer.writerow(el['way'])
+            self.way_nodes_writer.writerows(el['way_nodes'])
+            self.way_tags_writer.writerows(el['way_tags'])
+            if self.way_geometry_file is not None and 'way_geometry' in el:
+                self.way_geometry_writer.writerow(el['way_geometry'])
+        elif element_type == 'relation':
+            self.relations_writer.writerow(el['relation'])
+            self.relation_members_writer.writerows(el['relation_members'])
+            self.relation_tags_writer.writerows(el['relation_tags'])
+
+    def close(self):
+        for f in (self.nodes_file, self.nodes_tags_file, self.ways_file, self.way_nodes_file, self.way_tags_file,
+                  self.relations_file, self.relation_members_file, self.relation_tags_file):
+            f.close()
+        if self.way_geometry_file is not None:
+            self.way_geometry_file.close()
+
+
+class ShapeStage(object):
+    """ Pipeline stage that shapes each node, way and relation, optionally validates it, and sends it to a writer
+
+    Args:
+        writer: an object with the write and close methods of CsvWriter
+        validate(bool or ValidationSample): True validates each shaped element against the schema and raises an
+            exception at the first invalid one. With a ValidationSample only the elements it selects are validated,
+            and the errors are counted in self.report instead
+        node_store(NodeStore): if given, the shaped nodes are also added to it, so later stages can look them up by id
+        geometry_index(str): if given, the coordinates of the nodes are streamed to disk and sorted by id into this
+            memory-mapped file when the first way is found, and the geometry of each way is added to the shaped ways.
+            It needs the nodes before the ways, as they are in the osm files
+    """
+
+    def __init__(self, writer, validate=False, node_store=None, geometry_index=None):
+        self.writer = writer
+        self.validate = validate
+        self.validator = CompiledValidator()
+        self.sample = validate if isinstance(validate, ValidationSample) else None
+        self.report = ValidationReport() if self.sample is not None else None
+        self.node_store = node_store
+        self.coordinate_writer = CoordinateIndexWriter(geometry_index) if geometry_index is not None else None
+        self.coordinate_index = None
+
+    def process(self, element):
+        if element.tag == 'way' and self.coordinate_writer is not None:
+            self.coordinate_index = self.coordinate_writer.close()
+            self.coordinate_writer = None
+        if element.tag in ELEMENT_PARTS:
+            el = shape_element(element, coordinate_index=self.coordinate_index)
+            if el:
+                if self.sample is not None:
+                    if self.sample.select(element.tag):
+                        self.validator.validate(el)
+                        self.report.add(element.tag, self.validator.errors)
+                    else:
+                        self.report.add(element.tag, validated=False)
+                elif self.validate is True:
+                    validate_element(el, self.validator)
+                if element.tag == 'node':
+                    if self.node_store is not None:
+                        self.node_store.add(el['node'])
+                    if self.coordinate_writer is not None:
+                        node = el['node']
+                        self.coordinate_writer.add(node['id'], node['lat'], node['lon'])
+                self.writer.write(element.tag, el)
+        return element
+
+    def finish(self):
+        if self.coordinate_writer is not None:  # there were no ways
+            self.coordinate_index = self.coordinate_writer.close()
+            self.coordinate_writer = None
+        self.writer.close()
+        return self.node_store
+
+
+""" Part of the code below was provided by Udacity - Case Study: OpenStreetMap data (SQL)"""
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(input_tree, validate, writer=None, geometry=False):
+    """Iteratively process each XML element and write to csv(s)
+
+    A different writer, like h_create_db.SqliteWriter, can be given to send the elements somewhere else. With
+    geometry the length, bounding box and centroid of the ways are also written. If validate is a ValidationSample
+    the ValidationReport is returned"""
+
+    stage = ShapeStage(writer or CsvWriter(geometry=geometry), validate,
+                       geometry_index=NODE_INDEX_FILE if geometry else None)
+    try:
+        for element in get_element(input_tree):
+            stage.process(element)
+    finally:
+        stage.finish()
+    return stage.report
+
+
+def benchmark_writers(osmfile, repeat=3):
+    """ Prints the time DictCsvWriter and CsvWriter take to write the csv files of an osm file, the best of repeat
+    runs. The elements are cleaned and shaped before the writers are timed, so only the writing is measured. The
+    files are written to temporary directories and checked to be the same
+
+    Args:
+        osmfile(str): name of the osm file, for example med_sample.osm
+        repeat(int): number of times each writer is run
+    """
+    elements = [(element.tag, shape_element(element))
+                for element in stream_st_names_and_postalcodes(osmfile)]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        times = {}
+        for writer_class in (DictCsvWriter, CsvWriter):
+            output_dir = os.path.join(tmp_dir, writer_class.__name__)
+            os.mkdir(output_dir)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                writer = writer_class(output_dir)
+                for element_type, el in elements:
+                    writer.write(element_type, el)
+                writer.close()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            times[writer_class.__name__] = best
+        for path, fields in CSV_FILES:
+            with open(os.path.join(tmp_dir, 'DictCsvWriter', path), 'rb') as a, \
+                    open(os.path.join(tmp_dir, 'CsvWriter', path), 'rb') as b:
+                if a.read() != b.read():
+                    print("{0} is different".format(path))
+    finally:
+        shutil.rmtree(tmp_dir)
+    for name, elapsed in times.items():
+        print("{0:>14}: {1:.3f}s ({2:.0f} elements/sec)".format(name, elapsed, len(elements) / elapsed))
+    print("{0:>14}: {1:.1f}x".format('speedup', times['DictCsvWriter'] / times['CsvWriter']))
+
+
+# ================================================== #
+#               Parallel Mode                        #
+# ================================================== #
+
+def find_shards(osmfile, num_shards):
+    """ Splits an osm file in byte ranges that start and end on top level element boundaries
+
+    Args:
+        osmfile(str): name of the osm file
+        num_shards(int): number of shards wanted, less are returned if the file is small
+    Returns:
+        shards(list): (start, end) byte offsets of each shard, in file order
+    """
+    size = os.path.getsize(osmfile)
+    with open(osmfile, 'rb') as f:
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+        end = size - len(tail) + tail.rfind(b'</osm>')
+        boundaries = []
+        for i in range(num_shards):
+            start = _next_element_start(f, size * i // num_shards, end)
+            if not boundaries or start > boundaries[-1]:
+                boundaries.append(start)
+    boundaries.append(end)
+    return [(start, stop) for start, stop in zip(boundaries, boundaries[1:]) if start < stop]
+
+
+def _next_element_start(f, offset, end, block_size=1 << 20):
+    """ Returns the offset of the first top level element that starts at or after offset, or end if there is none"""
+    while offset < end:
+        f.seek(offset)
+        # Read a bit more than the block so a tag cut at the end of the block is found in the next one
+        block = f.read(block_size + 16)
+        match = TOP_LEVEL_RE.search(block)
+        if match and match.start() < block_size:
+            return min(offset + match.start(), end)
+        offset += block_size
+    return end
+
+
+def iter_shard_elements(osmfile, start, end, chunk_size=1 << 20):
+    """ Yields the top level elements found between two byte offsets of an osm file, freeing each one after it is
+    used
+
+    Args:
+        osmfile(str): name of the osm file
+        start(int), end(int): a shard returned by find_shards
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    parser.feed(b'<osm>')
+    root = None
+    with open(osmfile, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            parser.feed(data)
+            if remaining <= 0:
+                parser.feed(b'</osm>')
+            for event, elem in parser.read_events():
+                if root is None:
+                    root = elem
+                elif event == 'end' and elem.tag in ('node', 'way', 'relation'):
+                    yield elem
+                    root.clear()
+    parser.close()
+
+
+def _process_shard(args):
+    """ Cleans and shapes a shard of the osm file and writes it to csv files in its own directory. Returns the
+    directory and the ValidationReport of the shard"""
+    osmfile, start, end, output_dir, validate = args
+    cleaning = CleaningStage(get_postal_index(POSTALCODES_FILE))
+    stage = ShapeStage(CsvWriter(output_dir), validate)
+    try:
+        for element in iter_shard_elements(osmfile, start, end):
+            element = cleaning.process(element)
+            if element is not None:
+                stage.process(element)
+    finally:
+        stage.finish()
+    return output_dir, stage.report
+
+
+def merge_csv_files(shard_dirs, output_dir='.'):
+    """ Merges the csv files written for each shard in id order. Each shard is already sorted, as the elements are
+    sorted by id in the osm file, so the files are merged without loading them in memory
+
+    Args:
+        shard_dirs(list): directories with the csv files of each shard
+        output_dir(str): directory where the merged csv files are written
+    """
+    for path, fields in CSV_FILES:
+        files = [open(os.path.join(d, path), 'r', encoding='utf8', newline='') for d in shard_dirs]
+        try:
+            readers = []
+            for f in files:
+                reader = text_csv.reader(f)
+                next(reader, None)  # skip the header
+                readers.append(reader)
+            with open(os.path.join(output_dir, path), 'w', encoding='utf8', newline='') as out:
+                writer = text_csv.writer(out)
+                writer.writerow(fields)
+                # heapq.merge is stable, so the rows with the same id keep the order they had in the shard
+                writer.writerows(heapq.merge(*readers, key=lambda row: int(row[0])))
+        finally:
+            for f in files:
+                f.close()
+
+
+def process_map_parallel(osmfile, validate, processes=None, shards_per_process=4):
+    """ Cleans and shapes an osm file with a pool of processes and writes the same csv files as process_map
+
+    The shards are byte ranges of the xml file, so a compressed or pbf file can not be split and is processed with a
+    single process instead. The blobs of the pbf files are still decoded by a pool of processes
+
+    Args:
+        osmfile(str): name of the osm file
+        validate(bool or ValidationSample): validate each element against the schema, or the ones selected by the
+            sample. The sample is applied to each shard, and the merged ValidationReport is returned
+        processes(int): number of processes, by default the number of cores
+        shards_per_process(int): the file is split in more shards than processes to balance the work
+    """
+    if is_compressed(osmfile) or is_pbf(osmfile):
+        return process_map(stream_st_names_and_postalcodes(osmfile), validate)
+    processes = processes or multiprocessing.cpu_count()
+    get_postal_index(POSTALCODES_FILE)  # built here if needed, so the shards only load it
+    shards = find_shards(osmfile, processes * shards_per_process)
+    tmp_dir = tempfile.mkdtemp(prefix='osm_shards_', dir='.')
+    try:
+        tasks = []
+        for i, (start, end) in enumerate(shards):
+            shard_dir = os.path.join(tmp_dir, str(i))
+            os.mkdir(shard_dir)
+            tasks.append((osmfile, start, end, shard_dir, validate))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_process_shard, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        merge_csv_files([shard_dir for shard_dir, report in results])
+    finally:
+        shutil.rmtree(tmp_dir)
+    if isinstance(validate, ValidationSample):
+        report = ValidationReport()
+        for shard_dir, shard_report in results:
+            report.update(shard_report)
+        return report
+
+
+def add_sampling_arguments(parser):
+    """ Adds the options of a ValidationSample to an argument parser"""
+    parser.add_argument('--validate-every', type=int, metavar='K', help="validate every k-th element of each type")
+    parser.add_argument('--validate-fraction', type=float, metavar='F',
+                        help="validate each element with probability F")
+    parser.add_argument('--validate-first', type=int, metavar='N', help="validate the first N elements of each type")
+    parser.add_argument('--seed', type=int, help="seed of --validate-fraction, to repeat a run")
+
+
+def validation_from_args(args):
+    """ Returns what ShapeStage takes as validate: a ValidationSample if any of its options was given, otherwise
+    args.validate"""
+    if args.validate_every is None and args.validate_fraction is None and args.validate_first is None:
+        return args.validate
+    return ValidationSample(args.validate_every, args.validate_fraction, args.validate_first, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean an osm file and write the nodes and ways to csv files")
+    parser.add_argument('osm_file', nargs='?', default=OSMFILE)
+    parser.add_argument('--validate', action='store_true', help="validate each element against the schema")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="number of processes, 0 uses all the cores (default: 1, no parallel mode). Only for the "
+                             "csv files")
+    parser.add_argument('--sqlite', metavar='SQLITE_FILE',
+                        help="insert the elements directly in a new data base instead of writing csv files")
+    parser.add_argument('--parquet', metavar='OUTPUT_DIR',
+                        help="write typed and compressed parquet files to this directory instead of csv files "
+                             "(needs pyarrow)")
+    parser.add_argument('--batch-size', type=int, default=50000, help="rows inserted in each transaction")
+    parser.add_argument('--fast', action='store_true',
+                        help="turn off the sqlite journal and disk syncs while loading the data base")
+    parser.add_argument('--geometry', action='store_true',
+                        help="also write the length, bounding box and centroid of each way (not in parallel mode)")
+    add_sampling_arguments(parser)
+    parser.add_argument('--benchmark-writers', action='store_true',
+                        help="time the csv writers on the osm file instead of writing the csv files")
+    args = parser.parse_args()
+    if args.benchmark_writers:
+        benchmark_writers(args.osm_file)
+        return
+    if args.processes != 1 and (args.sqlite or args.parquet):
+        parser.error("--processes only writes csv files and can not be used with --sqlite or --parquet")
+    if args.geometry and args.processes != 1:
+        parser.error("--geometry needs the nodes of the whole file and can not be used with --processes")
+    validate = validation_from_args(args)
+    if args.sqlite or args.parquet:
+        if args.sqlite:
+            writer = SqliteWriter(args.sqlite, batch_size=args.batch_size, fast=args.fast)
+        else:
+            writer = ParquetWriter(args.parquet)
+        report = process_map(stream_st_names_and_postalcodes(args.osm_file), validate=validate, writer=writer,
+                             geometry=args.geometry)
+    elif args.processes == 1:
+        report = process_map(stream_st_names_and_postalcodes(args.osm_file), validate=validate, geometry=args.geometry)
+    else:
+        report = process_map_parallel(args.osm_file, validate, processes=args.processes or None)
+    if report is not None:
+        print(report.summary())
+
+
+if __name__ == '__main__':
+    main()
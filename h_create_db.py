@@ -1,118 +1,504 @@
-import sqlite3
-import csv
-
-''' This code was obtained from this link 
-https://discussions.udacity.com/t/creating-db-file-from-csv-files-with-non-ascii-unicode-characters/174958/7 '''
-
-
-sqlite_file = 'BuenosAires.db'
-#
-# # Connect to the database
-conn = sqlite3.connect(sqlite_file)
-#
-# # Get a cursor object
-cur = conn.cursor()
-
-# Create the table, specifying the column names and data types:
-cur.execute('''
-    CREATE TABLE nodes (
-    id INTEGER PRIMARY KEY NOT NULL,
-    lat REAL,
-    lon REAL,
-    user TEXT,
-    uid INTEGER,
-    version INTEGER,
-    changeset INTEGER,
-    timestamp TEXT
-)
-''')
-# commit the changes
-conn.commit()
-
-cur.execute('''
-    CREATE TABLE nodes_tags (
-    id INTEGER,
-    key TEXT,
-    value TEXT,
-    type TEXT,
-    FOREIGN KEY (id) REFERENCES nodes(id)
-)
-''')
-# commit the changes
-conn.commit()
-
-cur.execute('''
-    CREATE TABLE ways (
-    id INTEGER PRIMARY KEY NOT NULL,
-    user TEXT,
-    uid INTEGER,
-    version TEXT,
-    changeset INTEGER,
-    timestamp TEXT
-)
-''')
-# commit the changes
-conn.commit()
-
-cur.execute('''
-    CREATE TABLE ways_tags (
-    id INTEGER NOT NULL,
-    key TEXT NOT NULL,
-    value TEXT NOT NULL,
-    type TEXT,
-    FOREIGN KEY (id) REFERENCES ways(id)
-)
-''')
-# commit the changes
-conn.commit()
-
-cur.execute('''
-    CREATE TABLE ways_nodes (
-    id INTEGER NOT NULL,
-    node_id INTEGER NOT NULL,
-    position INTEGER NOT NULL,
-    FOREIGN KEY (id) REFERENCES ways(id),
-    FOREIGN KEY (node_id) REFERENCES nodes(id)
-)
-''')
-# commit the changes
-conn.commit()
-
-
-def fill_tables(csvfile, tablename, sqlite_file):
-    """ Fills a database table
-
-    Args:
-        csvfile(str): name of the csv data file
-        tablename(str): name of the table
-        sqlite_file(str): name of the data base
-        """
-    conn = sqlite3.connect(sqlite_file)
-    cur = conn.cursor()
-    with open(csvfile, 'r', encoding="utf8") as f:
-        reader = csv.DictReader(f) # comma is default delimiter
-        headers_list = reader.fieldnames
-        headers_names = ', '.join(headers_list)
-        headers_names = '(' + headers_names + ')'
-        interrogation_list = ['?'] * len(headers_list)
-        interrogation = ', '.join(interrogation_list)
-        interrogation = '(' + interrogation + ');'
-        to_database = []
-        for row_dict in reader:
-            list_to_db = []
-            for title in headers_list:
-                list_to_db.append(row_dict[title])
-            to_database.append(list_to_db)
-    # insert the formatted data
-    cur.executemany("INSERT INTO " + tablename + headers_names + " VALUES " + interrogation, to_database)
-    # commit the changes
-    conn.commit()
-    conn.close()
-
-fill_tables('nodes.csv', 'nodes', 'BuenosAires.db')
-fill_tables('nodes_tags.csv', 'nodes_tags', 'BuenosAires.db')
-fill_tables('ways.csv', 'ways', 'BuenosAires.db')
-fill_tables('ways_tags.csv', 'ways_tags', 'BuenosAires.db')
-fill_tables('ways_nodes.csv', 'ways_nodes', 'BuenosAires.db')
-
-conn.close()
+import argparse
+import os
+import sqlite3
+import csv
+import time
+import schema
+
+''' This code was obtained from this link
+https://discussions.udacity.com/t/creating-db-file-from-csv-files-with-non-ascii-unicode-characters/174958/7 '''
+
+
+SQLITE_FILE = 'BuenosAires.db'
+
+# Tables in the order they have to be filled, with the csv file written by g_write_csv for each of them
+CSV_FILES = [('nodes.csv', 'nodes'),
+             ('nodes_tags.csv', 'nodes_tags'),
+             ('ways.csv', 'ways'),
+             ('ways_tags.csv', 'ways_tags'),
+             ('ways_nodes.csv', 'ways_nodes'),
+             ('relations.csv', 'relations'),
+             ('relations_tags.csv', 'relations_tags'),
+             ('relations_members.csv', 'relations_members')]
+# Only written by g_write_csv with --geometry, the table is left empty when the file does not exist
+OPTIONAL_CSV_FILES = [('ways_geometry.csv', 'ways_geometry')]
+
+# Table where each part of an element returned by g_write_csv.shape_element is inserted
+TABLES = {'node': 'nodes',
+          'node_tags': 'nodes_tags',
+          'way': 'ways',
+          'way_nodes': 'ways_nodes',
+          'way_tags': 'ways_tags',
+          'way_geometry': 'ways_geometry',
+          'relation': 'relations',
+          'relation_members': 'relations_members',
+          'relation_tags': 'relations_tags'}
+PARTS = {table: part for part, table in TABLES.items()}
+# Parts of the elements of each type, way_geometry is only in the ways shaped with a geometry index
+ELEMENT_PARTS = {'node': ['node', 'node_tags'],
+                 'way': ['way', 'way_nodes', 'way_tags', 'way_geometry'],
+                 'relation': ['relation', 'relation_members', 'relation_tags']}
+
+# Created after the tables are filled, as updating the indexes on each insert is slower.
+# The reports in i_db_queries filter the tags by key and value and then join them by id, so the tags tables have a
+# covering index for each direction, which also has the tag type. The contributors report joins ways_nodes to nodes by
+# node_id.
+INDEXES = [('nodes_tags_key_value', 'nodes_tags (key, value, type, id)'),
+           ('nodes_tags_id_key', 'nodes_tags (id, key, type, value)'),
+           ('ways_tags_key_value', 'ways_tags (key, value, type, id)'),
+           ('ways_tags_id_key', 'ways_tags (id, key, type, value)'),
+           ('ways_nodes_id', 'ways_nodes (id, node_id)'),
+           ('ways_nodes_node_id', 'ways_nodes (node_id, id)'),
+           ('relations_tags_key_value', 'relations_tags (key, value, id)'),
+           ('relations_tags_id_key', 'relations_tags (id, key, value)'),
+           ('relations_members_id', 'relations_members (id, position)'),
+           ('relations_members_member', 'relations_members (member_type, member_id, id)'),
+           ('nodes_timestamp', 'nodes (timestamp)'),
+           ('ways_timestamp', 'ways (timestamp)')]
+
+# Wide tables with one row per element and one column per tag, built from the tags tables by build_pivot_tables.
+# Each table has the elements that have a tag with the 'filter' key, of any type. Each column is the value of the tag
+# with a (type, key), so 'source:name' does not end in the name column. An element has one tag of each type and key,
+# so the reports over these tables return the same rows as the ones over the tags tables.
+PIVOT_TABLES = [
+    ('node_amenities', {'source': 'nodes_tags',
+                        'filter': 'amenity',
+                        'columns': [('amenity', 'regular', 'amenity'),
+                                    ('name', 'regular', 'name'),
+                                    ('cuisine', 'regular', 'cuisine'),
+                                    ('postcode', 'addr', 'postcode'),
+                                    ('street', 'addr', 'street')],
+                        'indexes': [('node_amenities_amenity_name', '(amenity, name)'),
+                                    ('node_amenities_amenity_cuisine', '(amenity, cuisine)')]}),
+    ('way_lanes', {'source': 'ways_tags',
+                   'filter': 'lanes',
+                   'columns': [('name', 'regular', 'name'),
+                               ('highway', 'regular', 'highway'),
+                               ('lanes', 'regular', 'lanes'),
+                               ('surface', 'regular', 'surface')],
+                   'indexes': [('way_lanes_lanes', '(lanes, name)')]}),
+]
+
+
+def create_tables(conn):
+    """ Creates the nodes, nodes_tags, ways, ways_tags, ways_nodes, ways_geometry, relations, relations_tags and
+    relations_members tables, if they do not exist
+
+    Args:
+        conn(Connection): connection to the data base
+        """
+    # Get a cursor object
+    cur = conn.cursor()
+
+    # Create the table, specifying the column names and data types:
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS nodes (
+        id INTEGER PRIMARY KEY NOT NULL,
+        lat REAL,
+        lon REAL,
+        user TEXT,
+        uid INTEGER,
+        version INTEGER,
+        changeset INTEGER,
+        timestamp TEXT
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS nodes_tags (
+        id INTEGER,
+        key TEXT,
+        value TEXT,
+        type TEXT,
+        FOREIGN KEY (id) REFERENCES nodes(id)
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS ways (
+        id INTEGER PRIMARY KEY NOT NULL,
+        user TEXT,
+        uid INTEGER,
+        version TEXT,
+        changeset INTEGER,
+        timestamp TEXT
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS ways_tags (
+        id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        type TEXT,
+        FOREIGN KEY (id) REFERENCES ways(id)
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS ways_nodes (
+        id INTEGER NOT NULL,
+        node_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        FOREIGN KEY (id) REFERENCES ways(id),
+        FOREIGN KEY (node_id) REFERENCES nodes(id)
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS ways_geometry (
+        id INTEGER PRIMARY KEY NOT NULL,
+        length REAL,
+        min_lat REAL,
+        min_lon REAL,
+        max_lat REAL,
+        max_lon REAL,
+        centroid_lat REAL,
+        centroid_lon REAL,
+        missing_nodes INTEGER,
+        FOREIGN KEY (id) REFERENCES ways(id)
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS relations (
+        id INTEGER PRIMARY KEY NOT NULL,
+        user TEXT,
+        uid INTEGER,
+        version TEXT,
+        changeset INTEGER,
+        timestamp TEXT
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS relations_tags (
+        id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        type TEXT,
+        FOREIGN KEY (id) REFERENCES relations(id)
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+    # member_id references nodes, ways or relations, depending on member_type
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS relations_members (
+        id INTEGER NOT NULL,
+        member_id INTEGER NOT NULL,
+        member_type TEXT NOT NULL,
+        role TEXT,
+        position INTEGER NOT NULL,
+        FOREIGN KEY (id) REFERENCES relations(id)
+    )
+    ''')
+    # commit the changes
+    conn.commit()
+
+
+def drop_tables(conn):
+    """ Drops the tables created by create_tables and the PIVOT_TABLES
+
+    Args:
+        conn(Connection): connection to the data base
+        """
+    for table in list(TABLES.values()) + [table for table, spec in PIVOT_TABLES]:
+        conn.execute('DROP TABLE IF EXISTS {0}'.format(table))
+    conn.commit()
+
+
+def create_indexes(conn):
+    """ Creates the INDEXES and updates the statistics used by the query planner. It should be called once the
+    tables are filled
+
+    Args:
+        conn(Connection): connection to the data base
+        """
+    cur = conn.cursor()
+    for name, columns in INDEXES:
+        cur.execute('CREATE INDEX IF NOT EXISTS {0} ON {1}'.format(name, columns))
+    conn.commit()
+    cur.execute('ANALYZE')
+    conn.commit()
+
+
+def drop_indexes(conn):
+    """ Drops the INDEXES and the statistics created by create_indexes
+
+    Args:
+        conn(Connection): connection to the data base
+        """
+    cur = conn.cursor()
+    for name, columns in INDEXES:
+        cur.execute('DROP INDEX IF EXISTS {0}'.format(name))
+    cur.execute('DROP TABLE IF EXISTS sqlite_stat1')
+    conn.commit()
+
+
+def build_pivot_tables(conn):
+    """ Creates the PIVOT_TABLES and fills them from the tags tables. It should be called once the tables are filled
+
+    Args:
+        conn(Connection): connection to the data base
+        """
+    cur = conn.cursor()
+    for table, spec in PIVOT_TABLES:
+        cur.execute('DROP TABLE IF EXISTS {0}'.format(table))
+        columns = ', '.join('{0} TEXT'.format(column) for column, tag_type, key in spec['columns'])
+        cur.execute('CREATE TABLE {0} (id INTEGER PRIMARY KEY NOT NULL, {1})'.format(table, columns))
+        cur.execute(_pivot_insert(table, spec), (spec['filter'],))
+        for name, columns in spec['indexes']:
+            cur.execute('CREATE INDEX {0} ON {1} {2}'.format(name, table, columns))
+        cur.execute('ANALYZE {0}'.format(table))
+    conn.commit()
+
+
+def drop_pivot_tables(conn):
+    """ Drops the PIVOT_TABLES
+
+    Args:
+        conn(Connection): connection to the data base
+        """
+    for table, spec in PIVOT_TABLES:
+        conn.execute('DROP TABLE IF EXISTS {0}'.format(table))
+    conn.commit()
+
+
+def refresh_pivot_tables(conn, node_ids, way_ids):
+    """ Updates the rows of the PIVOT_TABLES of some elements after their tags were changed. The elements that were
+    deleted or lost the filter tag are removed from the tables. It does not commit, so the changes are part of the
+    transaction of the caller
+
+    Args:
+        conn(Connection): connection to the data base
+        node_ids(iterable): ids of the changed nodes
+        way_ids(iterable): ids of the changed ways
+        """
+    cur = conn.cursor()
+    ids = {'nodes_tags': node_ids, 'ways_tags': way_ids}
+    cur.execute('CREATE TEMP TABLE IF NOT EXISTS pivot_ids (id INTEGER PRIMARY KEY)')
+    for table, spec in PIVOT_TABLES:
+        cur.execute('DELETE FROM pivot_ids')
+        cur.executemany('INSERT OR IGNORE INTO pivot_ids VALUES (?)', ((i,) for i in ids[spec['source']]))
+        cur.execute('DELETE FROM {0} WHERE id IN (SELECT id FROM pivot_ids)'.format(table))
+        cur.execute(_pivot_insert(table, spec, ' AND id IN (SELECT id FROM pivot_ids)'), (spec['filter'],))
+    cur.execute('DROP TABLE pivot_ids')
+
+
+def _pivot_insert(table, spec, only=''):
+    """ Returns the INSERT ... SELECT statement that fills a pivot table. Its parameter is the filter key"""
+    columns = ', '.join(column for column, tag_type, key in spec['columns'])
+    values = ', '.join("max(CASE WHEN type = '{0}' AND key = '{1}' THEN value END)".format(tag_type, key)
+                       for column, tag_type, key in spec['columns'])
+    return """INSERT INTO {table} (id, {columns})
+        SELECT id, {values} FROM {source}
+        WHERE id IN (SELECT id FROM {source} WHERE key = ?{only})
+        GROUP BY id""".format(table=table, columns=columns, values=values, source=spec['source'], only=only)
+
+
+def schema_fields(part):
+    """ Returns the fields of a part of a shaped element as they are defined in schema.py
+
+    Args:
+        part(str): a key of the schema, for example 'node' or 'way_tags'
+    Returns:
+        fields(dict): the rules of each field, for example {'id': {'required': True, 'type': 'integer', ...}, ...}
+        """
+    part_schema = schema.schema[part]['schema']
+    if part_schema.get('type') == 'dict':  # list of dicts, like node_tags
+        part_schema = part_schema['schema']
+    return part_schema
+
+
+def insert_statement(part):
+    """ Returns the INSERT statement for a part of a shaped element, with a named parameter for each field of the
+    schema
+
+    Args:
+        part(str): a key of the schema, for example 'node' or 'way_tags'
+        """
+    fields = list(schema_fields(part))
+    return "INSERT INTO {0} ({1}) VALUES ({2})".format(TABLES[part], ', '.join(fields),
+                                                       ', '.join(':' + f for f in fields))
+
+
+class SqliteWriter(object):
+    """ Inserts the shaped elements directly in the data base, without writing csv files. It has the same write and
+    close methods as g_write_csv.CsvWriter
+
+    Args:
+        sqlite_file(str): name of the data base, the tables are created in it
+        batch_size(int): number of rows inserted in each transaction
+        fast(bool): turns off the journal and the disk syncs while loading. Faster, but the data base can be
+            corrupted if the process is killed, so it should only be used to build a new data base
+        """
+
+    def __init__(self, sqlite_file=SQLITE_FILE, batch_size=50000, fast=False):
+        self.conn = sqlite3.connect(sqlite_file)
+        if fast:
+            self.conn.execute('PRAGMA journal_mode=OFF')
+            self.conn.execute('PRAGMA synchronous=OFF')
+        create_tables(self.conn)
+        self.batch_size = batch_size
+        self.statements = {part: insert_statement(part) for part in TABLES}
+        self.rows = {part: [] for part in TABLES}
+        self.buffered = 0
+
+    def write(self, element_type, el):
+        """ Buffers an element returned by shape_element and inserts the buffered rows when there are batch_size
+
+        Args:
+            element_type(str): 'node', 'way' or 'relation'
+            el(dict): the shaped element
+        """
+        for part in ELEMENT_PARTS[element_type]:
+            if part in el:
+                rows = [el[part]] if isinstance(el[part], dict) else el[part]
+                self.rows[part].extend(rows)
+                self.buffered += len(rows)
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Inserts the buffered rows in one transaction"""
+        cur = self.conn.cursor()
+        for part in TABLES:
+            if self.rows[part]:
+                cur.executemany(self.statements[part], self.rows[part])
+                self.rows[part] = []
+        self.conn.commit()
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        create_indexes(self.conn)
+        self.conn.close()
+
+
+def column_converters(tablename, headers):
+    """ Returns the function that converts the csv strings of each column to the type given in schema.py, or None
+    for the columns that are kept as strings
+
+    Args:
+        tablename(str): name of the table
+        headers(list): columns of the csv file
+        """
+    fields = schema_fields(PARTS[tablename])
+    return [fields[h].get('coerce') if h in fields else None for h in headers]
+
+
+def read_csv_chunks(csvfile, tablename, chunk_size=50000):
+    """ Reads a csv file written by g_write_csv in chunks, converting each column to its type
+
+    Args:
+        csvfile(str): name of the csv data file
+        tablename(str): name of the table the csv file belongs to
+        chunk_size(int): number of rows in each chunk
+    Yields:
+        headers(list), rows(list): the columns of the csv file and a list of at most chunk_size tuples
+        """
+    with open(csvfile, 'r', encoding="utf8", newline='') as f:
+        reader = csv.reader(f)  # comma is default delimiter
+        headers = next(reader)
+        converters = list(enumerate(column_converters(tablename, headers)))
+        typed = [(i, convert) for i, convert in converters if convert is not None]
+        rows = []
+        for row in reader:
+            for i, convert in typed:
+                row[i] = convert(row[i]) if row[i] != '' else None
+            rows.append(tuple(row))
+            if len(rows) == chunk_size:
+                yield headers, rows
+                rows = []
+        if rows:
+            yield headers, rows
+
+
+def fill_tables(csvfile, tablename, sqlite_file, chunk_size=50000):
+    """ Fills a database table. The csv file is inserted in chunks, so it is never loaded whole in memory
+
+    Args:
+        csvfile(str): name of the csv data file
+        tablename(str): name of the table
+        sqlite_file(str): name of the data base
+        chunk_size(int): number of rows inserted in each transaction
+        """
+    conn = sqlite3.connect(sqlite_file)
+    cur = conn.cursor()
+    start = time.time()
+    total = 0
+    for headers, rows in read_csv_chunks(csvfile, tablename, chunk_size):
+        statement = "INSERT INTO {0} ({1}) VALUES ({2})".format(tablename, ', '.join(headers),
+                                                                ', '.join(['?'] * len(headers)))
+        # insert the formatted data
+        cur.executemany(statement, rows)
+        # commit the changes
+        conn.commit()
+        total += len(rows)
+    conn.close()
+    elapsed = time.time() - start
+    print("{0}: {1} rows in {2:.1f}s ({3:.0f} rows/sec)".format(tablename, total, elapsed,
+                                                               total / elapsed if elapsed else 0))
+
+
+def create_db(sqlite_file=SQLITE_FILE, chunk_size=50000, pivot=False):
+    """ Creates the data base tables and fills them with the csv files. The tables of an existing data base are
+    dropped first, use k_update_db to update it instead
+
+    Args:
+        sqlite_file(str): name of the data base
+        chunk_size(int): number of rows inserted in each transaction
+        pivot(bool): also build the PIVOT_TABLES
+        """
+    # Connect to the database
+    conn = sqlite3.connect(sqlite_file)
+    drop_tables(conn)
+    create_tables(conn)
+    conn.close()
+    for csvfile, tablename in CSV_FILES:
+        fill_tables(csvfile, tablename, sqlite_file, chunk_size)
+    for csvfile, tablename in OPTIONAL_CSV_FILES:
+        if os.path.exists(csvfile):
+            fill_tables(csvfile, tablename, sqlite_file, chunk_size)
+    conn = sqlite3.connect(sqlite_file)
+    create_indexes(conn)
+    if pivot:
+        build_pivot_tables(conn)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the sqlite data base from the csv files")
+    parser.add_argument('sqlite_file', nargs='?', default=SQLITE_FILE)
+    parser.add_argument('--chunk-size', type=int, default=50000, help="rows inserted in each transaction")
+    parser.add_argument('--pivot', action='store_true',
+                        help="also build the tag pivot tables (node_amenities, way_lanes) used by the reports")
+    parser.add_argument('--pivot-only', action='store_true',
+                        help="only rebuild the tag pivot tables of an existing data base")
+    args = parser.parse_args()
+    if args.pivot_only:
+        conn = sqlite3.connect(args.sqlite_file)
+        build_pivot_tables(conn)
+        conn.close()
+    else:
+        create_db(args.sqlite_file, args.chunk_size, args.pivot)
+
+
+if __name__ == '__main__':
+    main()
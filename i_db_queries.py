@@ -1,72 +1,289 @@
-import sqlite3
-
-sqlite_file = 'BuenosAires.db'    # name of the sqlite database file
-#
-# # Connect to the database
-conn = sqlite3.connect(sqlite_file)
-#
-# # Get a cursor object
-cur = conn.cursor()
-
-print('Top 10 users contributors')
-
-cur.execute("""SELECT nodes.user, count(*) as num FROM nodes, ways, ways_nodes
-            WHERE nodes.id = ways_nodes.node_id AND ways_nodes.id = ways.id
-            GROUP BY nodes.uid, ways.uid ORDER BY num desc LIMIT 10""")
-print(cur.fetchall())
-
-print('\n' 'Grouping nodes by timestamp to know the time of the first and last modification')
-
-cur.execute('SELECT max(timestamp) as max, min(timestamp) as min FROM nodes')
-print(cur.fetchall())
-
-print('\n' 'Grouping ways by timestamp to know the time of the first and last modification')
-
-cur.execute('SELECT max(timestamp) as max, min(timestamp) as min FROM ways')
-print(cur.fetchall())
-
-print('\n' 'Top 10 amenities')
-
-cur.execute("""SELECT value, count(*) as num from nodes_tags where key = 'amenity' GROUP BY value ORDER BY num desc
-            LIMIT 10""")
-print(cur.fetchall())
-
-print('\n'  'The name and number of the most popular ice-cream shops in Buenos Aires')
-
-cur.execute("""SELECT b.value, count(*) as num
-            FROM nodes_tags as a, nodes_tags as b
-            WHERE a.id = b.id AND a.key = 'amenity' AND a.value = 'ice_cream' AND b.key = 'name'
-            GROUP BY b.value ORDER BY num desc LIMIT 5""")
-print(cur.fetchall())
-
-print('\n' 'The most common fast food restaurants')
-
-cur.execute("""SELECT b.value, count(*) as num
-            FROM nodes_tags as a, nodes_tags as b
-            WHERE a.id = b.id AND a.key = 'amenity' AND a.value = 'fast_food' AND b.key = 'name'
-            GROUP BY b.value ORDER BY num desc LIMIT 5""")
-print(cur.fetchall())
-
-print('\n' 'The most common cuisine type restaurants')
-
-cur.execute("""SELECT b.value, count(*) as num
-            FROM nodes_tags as a, nodes_tags as b
-            WHERE a.id = b.id AND a.key = 'amenity' AND a.value = 'restaurant' AND b.key = 'cuisine'
-            GROUP BY b.value ORDER BY num desc LIMIT 5""")
-print(cur.fetchall())
-
-print('\n' 'Types of ways surfaces')
-
-cur.execute("""SELECT value, count(*)*100.0 /
-            (SELECT count(*) FROM ways_tags WHERE key = 'surface') as percentage
-            FROM ways_tags GROUP BY value HAVING key = 'surface'
-            ORDER BY percentage desc LIMIT 10""")
-print(cur.fetchall())
-
-print('\n' 'The name of the highways with the most number of lanes')
-
-cur.execute("""SELECT a.value, b.value
-            FROM ways_tags as a, ways_tags as b
-            WHERE a.id = b.id AND a.key = 'name' AND b.key = 'lanes' AND CAST(b.value AS INTEGER) > 7
-            GROUP BY a.value ORDER BY CAST(b.value AS INTEGER) asc, CAST(a.value AS INTEGER) asc""")
-print(cur.fetchall())
+import argparse
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from h_create_db import create_indexes, drop_indexes, build_pivot_tables, drop_pivot_tables, PIVOT_TABLES
+
+SQLITE_FILE = 'BuenosAires.db'    # name of the sqlite database file
+
+CACHE_SIZE = 256  # number of results kept by cached_query
+POOL_SIZE = 4  # connections kept open for each data base
+
+# The queries use parameters, so sqlite prepares each of them only once per connection
+
+TOP_CONTRIBUTORS = """SELECT nodes.user, count(*) as num FROM nodes, ways, ways_nodes
+            WHERE nodes.id = ways_nodes.node_id AND ways_nodes.id = ways.id
+            GROUP BY nodes.uid, ways.uid ORDER BY num desc LIMIT ?"""
+
+# max and min are in separate subqueries so each one can be read from the end of the timestamp index.
+# Table names can not be parameters, so there is a query for each table
+FIRST_AND_LAST_MODIFICATION = {
+    'nodes': 'SELECT (SELECT max(timestamp) FROM nodes) as max, (SELECT min(timestamp) FROM nodes) as min',
+    'ways': 'SELECT (SELECT max(timestamp) FROM ways) as max, (SELECT min(timestamp) FROM ways) as min'}
+
+TOP_AMENITIES = """SELECT value, count(*) as num from nodes_tags where key = 'amenity' GROUP BY value ORDER BY num desc
+            LIMIT ?"""
+
+# Each node is counted once, even if the tags table has a tag of it twice
+TOP_NAMES_FOR_AMENITY = """SELECT b.value, count(DISTINCT b.id) as num
+            FROM nodes_tags as a, nodes_tags as b
+            WHERE a.id = b.id AND a.key = 'amenity' AND a.type = 'regular' AND a.value = ?
+            AND b.key = ? AND b.type = ?
+            GROUP BY b.value ORDER BY num desc, b.value LIMIT ?"""
+
+WAY_SURFACES = """SELECT value, count(*)*100.0 /
+            (SELECT count(*) FROM ways_tags WHERE key = 'surface') as percentage
+            FROM ways_tags GROUP BY value HAVING key = 'surface'
+            ORDER BY percentage desc LIMIT ?"""
+
+# The ways with the same name are one row, with the most lanes of them
+HIGHWAYS_WITH_MOST_LANES = """SELECT a.value, max(CAST(b.value AS INTEGER)) as lanes
+            FROM ways_tags as a, ways_tags as b
+            WHERE a.id = b.id AND a.key = 'name' AND a.type = 'regular'
+            AND b.key = 'lanes' AND b.type = 'regular' AND CAST(b.value AS INTEGER) > ?
+            GROUP BY a.value ORDER BY lanes asc, CAST(a.value AS INTEGER) asc, a.value"""
+
+# The same reports over the pivot tables built by h_create_db.build_pivot_tables, used when the data base has them
+
+# {0} is a column of node_amenities, only the ones in AMENITY_COLUMNS are used
+TOP_NAMES_FOR_AMENITY_PIVOT = """SELECT {0}, count(*) as num FROM node_amenities
+            WHERE amenity = ? AND {0} IS NOT NULL
+            GROUP BY {0} ORDER BY num desc, {0} LIMIT ?"""
+
+HIGHWAYS_WITH_MOST_LANES_PIVOT = """SELECT name, max(CAST(lanes AS INTEGER)) as max_lanes FROM way_lanes
+            WHERE name IS NOT NULL AND CAST(lanes AS INTEGER) > ?
+            GROUP BY name ORDER BY max_lanes asc, CAST(name AS INTEGER) asc, name"""
+
+# The column of node_amenities of each (type, key) of tag
+AMENITY_COLUMNS = {(tag_type, key): column
+                   for column, tag_type, key in dict(PIVOT_TABLES)['node_amenities']['columns']}
+
+
+class ConnectionPool(object):
+    """ Keeps open connections to a data base so they are reused between queries. It can be used from several
+    threads, each connection is used by one thread at a time
+
+    Args:
+        sqlite_file(str): name of the data base
+        size(int): maximum number of idle connections that are kept open
+    """
+
+    def __init__(self, sqlite_file, size=POOL_SIZE):
+        self.sqlite_file = sqlite_file
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.sqlite_file, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            try:
+                self.idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+_pools = {}
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_pool(sqlite_file=SQLITE_FILE):
+    """ Returns the ConnectionPool of a data base, creating it the first time"""
+    with _lock:
+        if sqlite_file not in _pools:
+            _pools[sqlite_file] = ConnectionPool(sqlite_file)
+        return _pools[sqlite_file]
+
+
+def cached_query(query, params=(), sqlite_file=SQLITE_FILE):
+    """ Runs a query and keeps its result. The result is reused while the data base file is not modified
+
+    Args:
+        query(str): sql query
+        params(tuple): parameters of the query
+        sqlite_file(str): name of the data base
+    Returns:
+        rows(list): the rows returned by the query
+    """
+    key = (query, tuple(params), sqlite_file, os.path.getmtime(sqlite_file))
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    with get_pool(sqlite_file).connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+    with _lock:
+        _cache[key] = rows
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return rows
+
+
+def clear_cache():
+    """ Forgets the results kept by cached_query and closes the pooled connections"""
+    with _lock:
+        _cache.clear()
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def has_pivot_tables(sqlite_file=SQLITE_FILE):
+    """ Returns True if the data base has the pivot tables built by h_create_db.build_pivot_tables"""
+    rows = cached_query("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN ({0})".format(
+        ', '.join('?' * len(PIVOT_TABLES))), tuple(table for table, spec in PIVOT_TABLES), sqlite_file)
+    return rows[0][0] == len(PIVOT_TABLES)
+
+
+def top_contributors(limit=10, sqlite_file=SQLITE_FILE):
+    """ Returns the users with the most nodes in ways, as (user, count) rows"""
+    return cached_query(TOP_CONTRIBUTORS, (limit,), sqlite_file)
+
+
+def first_and_last_modification(table='nodes', sqlite_file=SQLITE_FILE):
+    """ Returns the latest and earliest timestamps of the 'nodes' or 'ways' table"""
+    return cached_query(FIRST_AND_LAST_MODIFICATION[table], (), sqlite_file)
+
+
+def top_amenities(limit=10, sqlite_file=SQLITE_FILE):
+    """ Returns the most common amenities, as (amenity, count) rows. Each amenity tag is counted, so it does not use
+    the pivot tables, which keep one amenity per node. The nodes_tags_key_value index already covers the query"""
+    return cached_query(TOP_AMENITIES, (limit,), sqlite_file)
+
+
+def top_names_for_amenity(amenity, key='name', limit=5, tag_type='regular', sqlite_file=SQLITE_FILE):
+    """ Returns the most common values of a tag among the nodes of an amenity, counting each node once
+
+    Args:
+        amenity(str): value of the amenity tag, for example 'ice_cream'
+        key(str): tag whose values are counted, for example 'name' or 'cuisine'
+        limit(int): number of rows returned
+        tag_type(str): type of the counted tag, for example 'regular' for 'name' or 'addr' for 'addr:street'
+        sqlite_file(str): name of the data base
+    Returns:
+        rows(list): (value, count) rows, the most common first
+    """
+    column = AMENITY_COLUMNS.get((tag_type, key))
+    if column is not None and column != 'amenity' and has_pivot_tables(sqlite_file):
+        return cached_query(TOP_NAMES_FOR_AMENITY_PIVOT.format(column), (amenity, limit), sqlite_file)
+    return cached_query(TOP_NAMES_FOR_AMENITY, (amenity, key, tag_type, limit), sqlite_file)
+
+
+def way_surfaces(limit=10, sqlite_file=SQLITE_FILE):
+    """ Returns the percentage of ways of each surface type"""
+    return cached_query(WAY_SURFACES, (limit,), sqlite_file)
+
+
+def highways_with_most_lanes(min_lanes=7, sqlite_file=SQLITE_FILE):
+    """ Returns the name and number of lanes of the ways with more than min_lanes lanes"""
+    if has_pivot_tables(sqlite_file):
+        return cached_query(HIGHWAYS_WITH_MOST_LANES_PIVOT, (min_lanes,), sqlite_file)
+    return cached_query(HIGHWAYS_WITH_MOST_LANES, (min_lanes,), sqlite_file)
+
+
+# Each report is a title, the function that answers it and its arguments
+REPORTS = [
+    ('Top 10 users contributors', top_contributors, (10,)),
+    ('Grouping nodes by timestamp to know the time of the first and last modification',
+     first_and_last_modification, ('nodes',)),
+    ('Grouping ways by timestamp to know the time of the first and last modification',
+     first_and_last_modification, ('ways',)),
+    ('Top 10 amenities', top_amenities, (10,)),
+    ('The name and number of the most popular ice-cream shops in Buenos Aires',
+     top_names_for_amenity, ('ice_cream', 'name', 5)),
+    ('The most common fast food restaurants', top_names_for_amenity, ('fast_food', 'name', 5)),
+    ('The most common cuisine type restaurants', top_names_for_amenity, ('restaurant', 'cuisine', 5)),
+    ('Types of ways surfaces', way_surfaces, (10,)),
+    ('The name of the highways with the most number of lanes', highways_with_most_lanes, (7,)),
+]
+
+
+def run_queries(sqlite_file=SQLITE_FILE):
+    """ Runs each of the REPORTS and prints the results
+
+    Args:
+        sqlite_file(str): name of the data base
+        """
+    for i, (title, report, args) in enumerate(REPORTS):
+        print(title if i == 0 else '\n' + title)
+        print(report(*args, sqlite_file=sqlite_file))
+
+
+def time_reports(sqlite_file, repeat):
+    """ Returns the best time in milliseconds of each of the REPORTS, out of repeat runs. The cache is cleared
+    before each run, so the time is the time of the query"""
+    times = []
+    for title, report, args in REPORTS:
+        best = None
+        for _ in range(repeat):
+            clear_cache()
+            has_pivot_tables(sqlite_file)
+            start = time.perf_counter()
+            report(*args, sqlite_file=sqlite_file)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+    clear_cache()
+    return times
+
+
+def benchmark(sqlite_file=SQLITE_FILE, repeat=5):
+    """ Prints the time of each report without indexes, with the indexes of h_create_db.create_indexes and also
+    with the pivot tables of h_create_db.build_pivot_tables. The changes are made on a copy of the data base, so the
+    original file is not changed
+
+    Args:
+        sqlite_file(str): name of the data base
+        repeat(int): number of times each query is run, the best time is shown
+        """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(tmp_dir, os.path.basename(sqlite_file))
+        shutil.copy(sqlite_file, copy)
+        conn = sqlite3.connect(copy)
+        drop_pivot_tables(conn)
+        drop_indexes(conn)
+        before = time_reports(copy, repeat)
+        create_indexes(conn)
+        indexed = time_reports(copy, repeat)
+        build_pivot_tables(conn)
+        pivot = time_reports(copy, repeat)
+        conn.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+    print('{0:>12} {1:>12} {2:>12}  {3}'.format('no indexes', 'indexes', 'pivot', 'report (ms)'))
+    for (title, report, args), b, i, p in zip(REPORTS, before, indexed, pivot):
+        print('{0:12.2f} {1:12.2f} {2:12.2f}  {3}'.format(b, i, p, title))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the reports of the Buenos Aires data base")
+    parser.add_argument('sqlite_file', nargs='?', default=SQLITE_FILE)
+    parser.add_argument('--benchmark', action='store_true',
+                        help="time each report without indexes, with indexes and with the pivot tables instead of "
+                             "printing the results")
+    parser.add_argument('--repeat', type=int, default=5, help="times each report is run in the benchmark")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.sqlite_file, args.repeat)
+    else:
+        run_queries(args.sqlite_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+""" Writes the nodes and ways to parquet files, with typed and compressed columns. The types of the columns are the
+ones of schema.py, so the files can be read without parsing the numbers again. pyarrow is only needed for this
+export"""
+
+import argparse
+import os
+from h_create_db import schema_fields, read_csv_chunks, CSV_FILES, OPTIONAL_CSV_FILES, TABLES, ELEMENT_PARTS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+ROW_GROUP_SIZE = 100000  # rows in each row group of the parquet files
+COMPRESSION = 'zstd'
+
+# Parts that always have a file, even if they have no rows
+MAIN_PARTS = ['node', 'node_tags', 'way', 'way_nodes', 'way_tags', 'relation', 'relation_members', 'relation_tags']
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is needed to write parquet files, install it with: conda install pyarrow")
+
+
+def arrow_schema(part):
+    """ Returns the pyarrow schema of a part of a shaped element, with the fields and types of schema.py
+
+    Args:
+        part(str): a key of the schema, for example 'node' or 'way_tags'
+    """
+    _require_pyarrow()
+    types = {'integer': pa.int64(), 'float': pa.float64(), 'string': pa.string()}
+    return pa.schema([(field, types[rules['type']]) for field, rules in schema_fields(part).items()])
+
+
+class ParquetWriter(object):
+    """ Writes the shaped elements to a parquet file per table (nodes.parquet, nodes_tags.parquet, ...). It has the
+    same write and close methods as g_write_csv.CsvWriter. The values are converted to the types of schema.py and
+    kept by column, and every row_group_size rows of a table are written as a row group
+
+    Args:
+        output_dir(str): directory where the parquet files are written
+        row_group_size(int): number of rows in each row group
+        compression(str): compression of the columns, for example 'zstd', 'snappy' or 'none'
+    """
+
+    def __init__(self, output_dir='.', row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION):
+        _require_pyarrow()
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.fields = {part: [(field, rules.get('coerce')) for field, rules in schema_fields(part).items()]
+                       for part in TABLES}
+        self.columns = {part: {field: [] for field, coerce in fields} for part, fields in self.fields.items()}
+        self.buffered = {part: 0 for part in TABLES}
+        self.writers = {}
+
+    def write(self, element_type, el):
+        """ Buffers an element returned by shape_element and writes a row group when a table has row_group_size rows
+
+        Args:
+            element_type(str): 'node', 'way' or 'relation'
+            el(dict): the shaped element
+        """
+        for part in ELEMENT_PARTS[element_type]:
+            if part not in el:
+                continue
+            rows = [el[part]] if isinstance(el[part], dict) else el[part]
+            columns = self.columns[part]
+            for field, coerce in self.fields[part]:
+                column = columns[field]
+                if coerce is None:
+                    column.extend(row[field] for row in rows)
+                else:
+                    column.extend(coerce(row[field]) for row in rows)
+            self.buffered[part] += len(rows)
+            if self.buffered[part] >= self.row_group_size:
+                self.flush(part)
+
+    def flush(self, part):
+        """ Writes the buffered rows of a part as a row group"""
+        if part not in self.writers:
+            path = os.path.join(self.output_dir, TABLES[part] + '.parquet')
+            self.writers[part] = pq.ParquetWriter(path, arrow_schema(part), compression=self.compression)
+        if self.buffered[part]:
+            table = pa.table(self.columns[part], schema=self.writers[part].schema)
+            self.writers[part].write_table(table, row_group_size=self.row_group_size)
+            self.columns[part] = {field: [] for field, coerce in self.fields[part]}
+            self.buffered[part] = 0
+
+    def close(self):
+        for part in TABLES:
+            if part in MAIN_PARTS or self.buffered[part] or part in self.writers:
+                self.flush(part)
+        for writer in self.writers.values():
+            writer.close()
+
+
+def convert_csv_files(output_dir='.', row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION):
+    """ Converts the csv files written by g_write_csv to parquet files, reading them in chunks of row_group_size rows
+
+    Args:
+        output_dir(str): directory where the parquet files are written
+        row_group_size(int): number of rows in each row group
+        compression(str): compression of the columns
+    """
+    _require_pyarrow()
+    os.makedirs(output_dir, exist_ok=True)
+    csv_files = CSV_FILES + [(csvfile, table) for csvfile, table in OPTIONAL_CSV_FILES if os.path.exists(csvfile)]
+    parts = {table: part for part, table in TABLES.items()}
+    for csvfile, tablename in csv_files:
+        schema = arrow_schema(parts[tablename])
+        path = os.path.join(output_dir, tablename + '.parquet')
+        total = 0
+        with pq.ParquetWriter(path, schema, compression=compression) as writer:
+            for headers, rows in read_csv_chunks(csvfile, tablename, row_group_size):
+                columns = dict(zip(headers, zip(*rows)))
+                writer.write_table(pa.table({field: list(columns[field]) for field in schema.names}, schema=schema),
+                                   row_group_size=row_group_size)
+                total += len(rows)
+        print("{0}: {1} rows, {2:.1f} MB -> {3:.1f} MB".format(tablename, total, os.path.getsize(csvfile) / 1e6,
+                                                               os.path.getsize(path) / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the csv files written by g_write_csv to parquet files")
+    parser.add_argument('output_dir', nargs='?', default='.')
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE, help="rows in each row group")
+    parser.add_argument('--compression', default=COMPRESSION, help="zstd, snappy, gzip or none")
+    args = parser.parse_args()
+    convert_csv_files(args.output_dir, args.row_group_size, args.compression)
+
+
+if __name__ == '__main__':
+    main()
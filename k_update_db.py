@@ -0,0 +1,154 @@
+""" Updates the data base with an osm change file (.osc), instead of building it again from the whole extract"""
+
+import argparse
+import sqlite3
+import xml.etree.cElementTree as ET
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+import numpy as np
+from e_audit_postal_codes import get_postal_index, POSTALCODES_FILE
+from f_clean_osm_data import CleaningStage
+from g_write_csv import shape_element
+from h_create_db import create_tables, insert_statement, refresh_pivot_tables, ELEMENT_PARTS, PIVOT_TABLES, \
+    SQLITE_FILE, TABLES
+from node_store import way_geometry
+from osm_io import open_osm, ELEMENT_TAGS
+
+# Tables with the rows of each element type, they are deleted by id before the new rows are inserted
+ELEMENT_TABLES = {element_type: [TABLES[part] for part in parts] for element_type, parts in ELEMENT_PARTS.items()}
+
+
+def iter_changes(osc_file):
+    """ Yields the changes of an osm change file in order
+
+    Args:
+        osc_file(str): name of the change file, it can be compressed (.osc.gz, .osc.bz2 or .osc.xz)
+    Yields:
+        action(str): 'create', 'modify' or 'delete', element(Element): the node, way or relation
+    """
+    with open_osm(osc_file) as f:
+        context = iter(ET.iterparse(f, events=('start', 'end')))
+        _, root = next(context)
+        action, parent = None, root
+        for event, elem in context:
+            if elem.tag in ('create', 'modify', 'delete'):
+                if event == 'start':
+                    action, parent = elem.tag, elem
+                else:
+                    action, parent = None, root
+                    elem.clear()
+                    root.remove(elem)
+            elif event == 'end' and elem.tag in ELEMENT_TAGS:
+                yield action, elem
+                # the element is freed and taken out of its change block, so a big block does not pile up
+                elem.clear()
+                parent.remove(elem)
+
+
+def apply_changes(osc_file, sqlite_file=SQLITE_FILE, postal_index=None):
+    """ Applies an osm change file to the data base in one transaction. The created and modified nodes, ways and
+    relations are cleaned and shaped with the same rules as the full export, and their rows replace the old ones. The
+    deleted elements, and the ones the cleaning deletes, are removed. The pivot tables and the ways geometry, if the
+    data base has them, are updated for the changed elements
+
+    Args:
+        osc_file(str): name of the change file
+        sqlite_file(str): name of the data base, the tables are created if they do not exist
+        postal_index(PostalCodeIndex): valid postal codes, the index of BA_postalcodes.csv by default
+    Returns:
+        counts(Counter): number of changes applied, by (action, element type)
+    """
+    if postal_index is None:
+        postal_index = get_postal_index(POSTALCODES_FILE)
+    cleaning = CleaningStage(postal_index)
+    statements = {part: insert_statement(part) for part in TABLES}
+    counts = Counter()
+    changed = {element_type: set() for element_type in ELEMENT_PARTS}
+    conn = sqlite3.connect(sqlite_file)
+    try:
+        create_tables(conn)  # only creates the missing tables, before the update starts
+        cur = conn.cursor()
+        for action, element in iter_changes(osc_file):
+            element_id = int(element.attrib['id'])
+            for table in ELEMENT_TABLES[element.tag]:
+                cur.execute('DELETE FROM {0} WHERE id = ?'.format(table), (element_id,))
+            if action != 'delete':
+                cleaned = cleaning.process(element)
+                if cleaned is not None:
+                    el = shape_element(cleaned)
+                    for part in ELEMENT_PARTS[element.tag]:
+                        if part in el:
+                            rows = el[part] if isinstance(el[part], list) else [el[part]]
+                            cur.executemany(statements[part], rows)
+            changed[element.tag].add(element_id)
+            counts[(action, element.tag)] += 1
+        if has_geometry(conn):
+            update_geometry(conn, changed['node'], changed['way'])
+        if all(has_table(conn, table) for table, spec in PIVOT_TABLES):
+            refresh_pivot_tables(conn, changed['node'], changed['way'])
+        conn.commit()  # the only commit of the update
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return counts
+
+
+def has_table(conn, table):
+    """ Returns True if the data base has the table"""
+    return conn.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,)).fetchone()[0] == 1
+
+
+def has_geometry(conn):
+    """ Returns True if the ways_geometry table was filled, by g_write_csv --geometry"""
+    return conn.execute('SELECT EXISTS (SELECT 1 FROM ways_geometry)').fetchone()[0] == 1
+
+
+def update_geometry(conn, node_ids, way_ids):
+    """ Computes again the geometry of the changed ways and of the ways that have a changed node, with the
+    coordinates of the nodes table
+
+    Args:
+        conn(Connection): connection to the data base
+        node_ids(set): ids of the changed nodes
+        way_ids(set): ids of the changed ways
+        """
+    cur = conn.cursor()
+    cur.execute('CREATE TEMP TABLE IF NOT EXISTS geometry_ids (id INTEGER PRIMARY KEY)')
+    cur.execute('DELETE FROM geometry_ids')
+    cur.executemany('INSERT OR IGNORE INTO geometry_ids VALUES (?)', ((i,) for i in way_ids))
+    cur.executemany('INSERT OR IGNORE INTO geometry_ids SELECT id FROM ways_nodes WHERE node_id = ?',
+                    ((i,) for i in node_ids))
+    cur.execute('DELETE FROM ways_geometry WHERE id IN (SELECT id FROM geometry_ids)')
+    rows = cur.execute('''SELECT ways_nodes.id, nodes.lat, nodes.lon
+        FROM ways_nodes LEFT JOIN nodes ON nodes.id = ways_nodes.node_id
+        WHERE ways_nodes.id IN (SELECT id FROM geometry_ids)
+        ORDER BY ways_nodes.id, ways_nodes.position''').fetchall()
+    statement = insert_statement('way_geometry')
+    for way_id, way_rows in groupby(rows, key=itemgetter(0)):
+        way_rows = list(way_rows)
+        found = [(lat, lon) for i, lat, lon in way_rows if lat is not None]
+        geometry = way_geometry(np.array([lat for lat, lon in found], dtype=float),
+                                np.array([lon for lat, lon in found], dtype=float))
+        if geometry is not None:
+            geometry['id'] = way_id
+            geometry['missing_nodes'] = len(way_rows) - len(found)
+            cur.execute(statement, geometry)
+    cur.execute('DROP TABLE geometry_ids')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply an osm change file (.osc) to the data base")
+    parser.add_argument('osc_file')
+    parser.add_argument('sqlite_file', nargs='?', default=SQLITE_FILE)
+    args = parser.parse_args()
+    counts = apply_changes(args.osc_file, args.sqlite_file)
+    for (action, element_type), count in sorted(counts.items()):
+        print("{0} {1}: {2}".format(action, element_type, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+""" Compact storage of the nodes attributes"""
+
+import calendar
+import os
+import tempfile
+import time
+from array import array
+import numpy as np
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+NODE_INDEX_FILE = 'nodes_index.npy'  # default file of the CoordinateIndex
+COORDINATE_DTYPE = np.dtype([('id', np.int64), ('lat', np.float64), ('lon', np.float64)])
+# The CoordinateIndex keeps an offset for every id between the first and the last one when there are at most
+# DENSE_FACTOR ids per node, otherwise the ids are found by binary search
+DENSE_FACTOR = 2
+SORT_CHUNK_SIZE = 1 << 20  # nodes sorted in memory at a time by the CoordinateIndexWriter
+EARTH_RADIUS = 6371008.8  # mean radius in meters
+
+
+class NodeStore(object):
+    """ Keeps the attributes of the nodes in typed arrays instead of a dict per node: id, changeset and timestamp as
+    int64, lat and lon as float64, uid and version as int32, and the user names interned in a list, so each node
+    takes 52 bytes.
+
+    The nodes are found by id with a binary search in the ids array. The osm files have the nodes sorted by id, so
+    no other index is kept. If the ids were added out of order, the ids sorted and the row of each one are kept in
+    two more int64 arrays, 16 bytes per node, built at the first lookup after a node was added.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.uids = array('i')
+        self.versions = array('i')
+        self.changesets = array('q')
+        self.timestamps = array('q')  # seconds since 1970-01-01 UTC
+        self.user_ids = array('i')
+        self.users = []  # each user name is stored once
+        self._user_index = {}
+        self._in_order = True  # each id was greater than the previous one
+        self._sorted_ids = None  # ids sorted and their rows, only when the ids were not added in order
+        self._sorted_rows = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, node_id):
+        return self.row(node_id) is not None
+
+    def add(self, attrib):
+        """ Adds a node
+
+        Args:
+            attrib(dict): the attributes of a node element, or the 'node' dict returned by g_write_csv.shape_element
+        """
+        node_id = int(attrib['id'])
+        user = attrib['user']
+        if user not in self._user_index:
+            self._user_index[user] = len(self.users)
+            self.users.append(user)
+        if self._in_order and len(self.ids) and node_id <= self.ids[-1]:
+            self._in_order = False
+        self._sorted_ids = self._sorted_rows = None
+        self.ids.append(node_id)
+        self.lats.append(float(attrib['lat']))
+        self.lons.append(float(attrib['lon']))
+        self.uids.append(int(attrib['uid']))
+        self.versions.append(int(attrib['version']))
+        self.changesets.append(int(attrib['changeset']))
+        self.timestamps.append(parse_timestamp(attrib['timestamp']))
+        self.user_ids.append(self._user_index[user])
+
+    def row(self, node_id):
+        """ Returns the position of a node in the arrays, or None if the node is not in the store. If an id was added
+        more than once, the last node added with it is returned"""
+        node_id = int(node_id)
+        if not len(self.ids):
+            return None
+        if self._in_order:
+            # a view of the array is only kept during the search, as it can not grow while a view exists
+            ids = np.frombuffer(self.ids, dtype=np.int64)
+            position = int(np.searchsorted(ids, node_id))
+            found = position < len(ids) and ids[position] == node_id
+            del ids
+            return position if found else None
+        if self._sorted_ids is None:
+            ids = np.frombuffer(self.ids, dtype=np.int64)
+            self._sorted_rows = np.argsort(ids, kind='stable')
+            self._sorted_ids = ids[self._sorted_rows]
+            del ids
+        position = int(np.searchsorted(self._sorted_ids, node_id, side='right')) - 1
+        if position < 0 or self._sorted_ids[position] != node_id:
+            return None
+        return int(self._sorted_rows[position])
+
+    def coordinates(self, node_id):
+        """ Returns the (lat, lon) of a node, or None if the node is not in the store"""
+        row = self.row(node_id)
+        if row is None:
+            return None
+        return self.lats[row], self.lons[row]
+
+    def get(self, node_id):
+        """ Returns the attributes of a node with the same keys as the 'node' dict of g_write_csv.shape_element, or
+        None if the node is not in the store"""
+        row = self.row(node_id)
+        if row is None:
+            return None
+        return {'id': self.ids[row],
+                'lat': self.lats[row],
+                'lon': self.lons[row],
+                'user': self.users[self.user_ids[row]],
+                'uid': self.uids[row],
+                'version': self.versions[row],
+                'changeset': self.changesets[row],
+                'timestamp': format_timestamp(self.timestamps[row])}
+
+    def nbytes(self):
+        """ Returns the approximate memory used by the arrays and the sorted ids, without the user names"""
+        arrays = (self.ids, self.lats, self.lons, self.uids, self.versions, self.changesets, self.timestamps,
+                  self.user_ids)
+        total = sum(a.itemsize * len(a) for a in arrays)
+        if self._sorted_ids is not None:
+            total += self._sorted_ids.nbytes + self._sorted_rows.nbytes
+        return total
+
+
+def parse_timestamp(timestamp):
+    """ Converts an osm timestamp like '2017-05-01T10:00:00Z' to seconds since 1970-01-01 UTC"""
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+
+
+def format_timestamp(seconds):
+    """ Converts seconds since 1970-01-01 UTC to an osm timestamp like '2017-05-01T10:00:00Z'"""
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))
+
+
+class CoordinateIndex(object):
+    """ The coordinates of the nodes sorted by id in a memory-mapped file, so the node refs of the ways can be
+    resolved without keeping the nodes in memory or querying the data base. The ids are found by binary search, or
+    by their offset from the first id when the ids are dense.
+
+    Args:
+        path(str): .npy file written by CoordinateIndex.build
+    """
+
+    def __init__(self, path=NODE_INDEX_FILE):
+        self.path = path
+        self.table = np.load(path, mmap_mode='r')
+        self.ids = self.table['id']
+        self.lats = self.table['lat']
+        self.lons = self.table['lon']
+        offsets_path = _offsets_path(path)
+        self.offsets = np.load(offsets_path, mmap_mode='r') if os.path.exists(offsets_path) else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, node_store, path=NODE_INDEX_FILE):
+        """ Writes the coordinates of the nodes of a NodeStore sorted by id and returns the index
+
+        Args:
+            node_store(NodeStore): the nodes
+            path(str): name of the .npy file, the offsets of dense ids are written next to it
+        """
+        writer = CoordinateIndexWriter(path)
+        writer.add_many(np.frombuffer(node_store.ids, dtype=np.int64), np.frombuffer(node_store.lats, dtype=np.float64),
+                        np.frombuffer(node_store.lons, dtype=np.float64))
+        return writer.close()
+
+    def rows(self, node_ids):
+        """ Returns the rows of some nodes and a mask with the ones that were found
+
+        Args:
+            node_ids(list): ids of the nodes
+        Returns:
+            rows(ndarray), found(ndarray): the row of each id, only valid where found is True
+        """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.zeros(len(node_ids), dtype=np.int64), np.zeros(len(node_ids), dtype=bool)
+        if self.offsets is not None:
+            positions = node_ids - self.ids[0]
+            in_range = (positions >= 0) & (positions < len(self.offsets))
+            rows = np.full(len(node_ids), -1, dtype=np.int64)
+            rows[in_range] = self.offsets[positions[in_range]]
+            found = rows >= 0
+        else:
+            rows = np.minimum(np.searchsorted(self.ids, node_ids), len(self.ids) - 1)
+            found = self.ids[rows] == node_ids
+        return rows, found
+
+    def coordinates(self, node_ids):
+        """ Returns the latitudes and longitudes of the nodes that are in the index, in the given order, and the
+        number of ids that were not found
+
+        Args:
+            node_ids(list): ids of the nodes
+        Returns:
+            lats(ndarray), lons(ndarray), missing(int)
+        """
+        rows, found = self.rows(node_ids)
+        rows = rows[found]
+        return self.lats[rows], self.lons[rows], len(found) - int(found.sum())
+
+
+class CoordinateIndexWriter(object):
+    """ Writes a CoordinateIndex from the nodes as they are read, without keeping them in memory. The (id, lat, lon)
+    of each node are appended to a temporary file next to the index. close sorts them by id on disk: chunks of
+    chunk_size nodes are sorted in memory and then merged into the index, a block of each chunk at a time. The osm
+    files have the nodes sorted by id, and then they are only copied.
+
+    Args:
+        path(str): name of the .npy file of the index
+        chunk_size(int): nodes sorted in memory at a time
+    """
+
+    def __init__(self, path=NODE_INDEX_FILE, chunk_size=SORT_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        self.tmp_file = os.fdopen(fd, 'wb')
+        self.buffer = []
+        self.count = 0
+
+    def add(self, node_id, lat, lon):
+        """ Adds the coordinates of a node"""
+        self.buffer.append((node_id, lat, lon))
+        if len(self.buffer) >= 65536:
+            self._flush()
+
+    def add_many(self, ids, lats, lons):
+        """ Adds the coordinates of many nodes, given as arrays"""
+        self._flush()
+        for start in range(0, len(ids), self.chunk_size):
+            chunk = np.empty(len(ids[start:start + self.chunk_size]), dtype=COORDINATE_DTYPE)
+            chunk['id'] = ids[start:start + self.chunk_size]
+            chunk['lat'] = lats[start:start + self.chunk_size]
+            chunk['lon'] = lons[start:start + self.chunk_size]
+            chunk.tofile(self.tmp_file)
+            self.count += len(chunk)
+
+    def _flush(self):
+        if self.buffer:
+            np.array(self.buffer, dtype=COORDINATE_DTYPE).tofile(self.tmp_file)
+            self.count += len(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        """ Sorts the nodes into the index file, deletes the temporary file and returns the CoordinateIndex"""
+        self._flush()
+        self.tmp_file.close()
+        try:
+            table = np.lib.format.open_memmap(self.path, mode='w+', dtype=COORDINATE_DTYPE, shape=(self.count,))
+            if self.count:
+                unsorted = np.memmap(self.tmp_path, dtype=COORDINATE_DTYPE, mode='r+', shape=(self.count,))
+                _sort_on_disk(unsorted, table, self.chunk_size)
+                del unsorted
+            table.flush()
+            _write_offsets(table, _offsets_path(self.path), self.chunk_size)
+            del table
+        finally:
+            os.remove(self.tmp_path)
+        return CoordinateIndex(self.path)
+
+
+def _sort_on_disk(unsorted, table, chunk_size):
+    """ Copies the nodes of unsorted to table sorted by id. Each chunk of unsorted is sorted in place, and then the
+    chunks are merged: a block of each chunk is read, and the nodes up to the smallest of the last ids of the blocks
+    are sorted and written, as no node that comes later in a chunk can be smaller than them"""
+    starts = list(range(0, len(unsorted), chunk_size))
+    ends = [min(start + chunk_size, len(unsorted)) for start in starts]
+    in_order = True
+    for start, end in zip(starts, ends):
+        ids = unsorted['id'][start:end]
+        if np.any(ids[1:] < ids[:-1]):
+            chunk = unsorted[start:end]
+            unsorted[start:end] = chunk[np.argsort(chunk['id'], kind='stable')]
+            in_order = False
+        elif start and unsorted['id'][start] < unsorted['id'][start - 1]:
+            in_order = False
+    if in_order:
+        for start, end in zip(starts, ends):
+            table[start:end] = unsorted[start:end]
+        return
+    block_size = max(1, chunk_size // len(starts))
+    cursors = list(starts)
+    written = 0
+    while written < len(table):
+        blocks = [unsorted[cursor:min(cursor + block_size, end)] for cursor, end in zip(cursors, ends)]
+        # the blocks that do not reach the end of their chunk limit the ids that can be written
+        limits = [block['id'][-1] for block, cursor, end in zip(blocks, cursors, ends) if cursor + len(block) < end]
+        limit = min(limits) if limits else None
+        merged = []
+        for i, block in enumerate(blocks):
+            taken = len(block) if limit is None else int(np.searchsorted(block['id'], limit, side='right'))
+            merged.append(block[:taken])
+            cursors[i] += taken
+        merged = np.concatenate(merged)
+        table[written:written + len(merged)] = merged[np.argsort(merged['id'], kind='stable')]
+        written += len(merged)
+
+
+def _write_offsets(table, offsets_path, chunk_size):
+    """ Writes the row of each id from the first to the last one of a sorted table, if the ids are dense. Otherwise
+    the offsets file is deleted"""
+    if os.path.exists(offsets_path):
+        os.remove(offsets_path)
+    if not len(table):
+        return
+    first = int(table['id'][0])
+    span = int(table['id'][-1]) - first + 1
+    if span > DENSE_FACTOR * len(table):
+        return
+    offsets = np.lib.format.open_memmap(offsets_path, mode='w+', dtype=np.int64, shape=(span,))
+    offsets[:] = -1
+    for start in range(0, len(table), chunk_size):
+        ids = table['id'][start:start + chunk_size]
+        offsets[ids - first] = np.arange(start, start + len(ids))
+    offsets.flush()
+    del offsets
+
+
+def _offsets_path(path):
+    """ Returns the name of the file with the offsets of the dense ids of a CoordinateIndex"""
+    return os.path.splitext(path)[0] + '_offsets.npy'
+
+
+def way_geometry(lats, lons):
+    """ Returns the length in meters, the bounding box and the centroid of a way
+
+    Args:
+        lats(ndarray), lons(ndarray): coordinates of the nodes of the way, in order
+    Returns:
+        geometry(dict): length, min_lat, min_lon, max_lat, max_lon, centroid_lat and centroid_lon, or None if the way
+            has no coordinates
+    """
+    if not len(lats):
+        return None
+    phi = np.radians(lats)
+    lam = np.radians(lons)
+    # haversine distance between each pair of consecutive nodes
+    a = np.sin(np.diff(phi) / 2) ** 2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2
+    length = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0))).sum()
+    if len(lats) > 1 and lats[0] == lats[-1] and lons[0] == lons[-1]:
+        lats, lons = lats[:-1], lons[:-1]  # the first node of a closed way is not counted twice in the centroid
+    return {'length': round(float(length), 2),
+            'min_lat': float(lats.min()),
+            'min_lon': float(lons.min()),
+            'max_lat': float(lats.max()),
+            'max_lon': float(lons.max()),
+            'centroid_lat': round(float(lats.mean()), 7),
+            'centroid_lon': round(float(lons.mean()), 7)}
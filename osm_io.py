@@ -0,0 +1,115 @@
+""" Opens osm files that can be compressed with gzip, bzip2 or xz, decompressing them while they are read"""
+
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import subprocess
+import xml.etree.cElementTree as ET
+from contextlib import contextmanager
+import osm_pbf
+
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# Top level elements of the osm files that are audited, cleaned and exported
+ELEMENT_TAGS = ('node', 'way', 'relation')
+
+# bzip2 decompressors that use all the cores, the first one installed is used for the .bz2 files
+PARALLEL_BZIP2 = ('lbzip2', 'pbzip2')
+
+
+def is_pbf(path):
+    """ Returns True if the file is an osm pbf file, by its name"""
+    return os.fsdecode(path).endswith('.pbf')
+
+
+def is_compressed(path):
+    """ Returns True if the name of the file ends with the suffix of one of the supported compressions"""
+    return os.fsdecode(path).endswith(tuple(OPENERS))
+
+
+def parallel_bzip2():
+    """ Returns the path of the first parallel bzip2 decompressor found, or None"""
+    for name in PARALLEL_BZIP2:
+        path = shutil.which(name)
+        if path is not None:
+            return path
+    return None
+
+
+@contextmanager
+def open_osm(path, parallel=True):
+    """ Opens an osm file to be read in binary mode, as ET.iterparse and ET.parse expect. The .osm.gz, .osm.bz2 and
+    .osm.xz files are decompressed while they are read, so no decompressed copy is written to disk.
+
+    bzip2 compresses the file in independent blocks, so when lbzip2 or pbzip2 is installed it is used to decompress
+    them with all the cores, in another process.
+
+    Args:
+        path(str): name of the osm file
+        parallel(bool): use lbzip2 or pbzip2 for the .bz2 files when they are installed
+    Yields:
+        f(file): binary file object
+    """
+    suffix = next((s for s in OPENERS if os.fsdecode(path).endswith(s)), None)
+    decompressor = parallel_bzip2() if parallel and suffix == '.bz2' else None
+    if decompressor is not None:
+        process = subprocess.Popen([decompressor, '-dc', path], stdout=subprocess.PIPE)
+        try:
+            yield process.stdout
+        except BaseException as error:
+            # the error of the reader is kept, a truncated output is often what made it fail
+            if _close_decompressor(process):
+                raise error from IOError("{0} could not decompress {1}".format(decompressor, path))
+            raise
+        if _close_decompressor(process):
+            raise IOError("{0} could not decompress {1}".format(decompressor, path))
+    else:
+        f = OPENERS[suffix](path, 'rb') if suffix else open(path, 'rb')
+        try:
+            yield f
+        finally:
+            f.close()
+
+
+def _close_decompressor(process):
+    """ Closes the output of a decompressor process, stopping it if it was not read to the end, and returns True if it
+    failed to decompress the file"""
+    finished = process.poll() is not None or process.stdout.read(1) == b''
+    process.stdout.close()
+    if not finished:  # the file was not read to the end
+        process.terminate()
+    return process.wait() != 0 and finished
+
+
+def iter_elements(path, tags=ELEMENT_TAGS, pbf_processes=None):
+    """ Yields the top level elements of an osm file whose tag is in tags. The xml files are read with iterparse and
+    each element is freed once the next one is read, so the memory used does not depend on the size of the file.
+
+    The .osm.pbf files are read with osm_pbf, which returns the same elements as the xml files.
+
+    Args:
+        path(str): name of the osm file, it can be compressed (.osm.gz, .osm.bz2 or .osm.xz) or a .osm.pbf file
+        tags(tuple): top level tags to yield
+        pbf_processes(int): number of processes that decode the pbf blobs, by default the number of cores
+    Yields:
+        element(Element)
+    """
+    if is_pbf(path):
+        for element in osm_pbf.iter_elements(path, tags, pbf_processes):
+            yield element
+        return
+    with open_osm(path) as f:
+        context = iter(ET.iterparse(f, events=('start', 'end')))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag in ELEMENT_TAGS:
+                if elem.tag in tags:
+                    yield elem
+                root.clear()
+
+
+# The code that reads the elements, for the cache keys of the results computed from them. osm_pbf formats the
+# timestamps with node_store.format_timestamp
+PARSER_CODE = [open_osm, iter_elements, osm_pbf.iter_elements, osm_pbf.format_timestamp]
@@ -0,0 +1,393 @@
+""" Reads osm pbf files, the protocol buffers encoding of the osm data, without a protobuf library. The elements are
+returned as ElementTree elements, like the ones of the xml files, so the audits, the cleaning and shape_element can
+be used on them
+
+File format: https://wiki.openstreetmap.org/wiki/PBF_Format"""
+
+import lzma
+import multiprocessing
+import struct
+import xml.etree.cElementTree as ET
+import zlib
+from collections import deque
+from node_store import format_timestamp
+
+SUPPORTED_FEATURES = {'OsmSchema-V0.6', 'DenseNodes'}
+MEMBER_TYPES = ['node', 'way', 'relation']
+
+
+# ================================================== #
+#               Protocol Buffers                     #
+# ================================================== #
+
+def _varint(buf, pos):
+    """ Decodes the varint that starts at pos and returns it with the position after it"""
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf):
+    """ Yields (field number, value) for each field of a message. The value is an int for the varints and bytes for
+    the length delimited fields"""
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = struct.unpack_from('<q', buf, pos)[0]
+            pos += 8
+        elif wire_type == 5:
+            value = struct.unpack_from('<i', buf, pos)[0]
+            pos += 4
+        else:
+            raise ValueError("unsupported protobuf wire type {0}".format(wire_type))
+        yield key >> 3, value
+
+
+def _signed(n):
+    """ int32 and int64 values are encoded as 64 bit two's complement"""
+    return n - (1 << 64) if n >= 1 << 63 else n
+
+
+def _zigzag(n):
+    """ sint32 and sint64 values are zigzag encoded"""
+    return (n >> 1) ^ -(n & 1)
+
+
+def _packed(buf):
+    """ Decodes a packed repeated field of varints"""
+    values = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = _varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def _packed_sint(buf):
+    return [_zigzag(n) for n in _packed(buf)]
+
+
+def _delta(values):
+    """ Undoes the delta coding of the packed ids, coordinates and refs"""
+    total = 0
+    result = []
+    for value in values:
+        total += value
+        result.append(total)
+    return result
+
+
+# ================================================== #
+#               Blobs                                #
+# ================================================== #
+
+def read_blobs(pbf_file):
+    """ Yields (type, blob) for each blob of a pbf file, without decompressing them
+
+    Args:
+        pbf_file(str): name of the pbf file
+    Yields:
+        blob_type(str): 'OSMHeader' or 'OSMData', blob(bytes): the encoded Blob message
+    """
+    with open(pbf_file, 'rb') as f:
+        while True:
+            size = f.read(4)
+            if not size:
+                return
+            header = f.read(struct.unpack('>i', size)[0])
+            blob_type, data_size = None, 0
+            for number, value in _fields(header):
+                if number == 1:
+                    blob_type = bytes(value).decode('utf-8')
+                elif number == 3:
+                    data_size = value
+            yield blob_type, f.read(data_size)
+
+
+def decode_blob(blob):
+    """ Returns the decompressed data of a Blob message"""
+    for number, value in _fields(blob):
+        if number == 1:
+            return bytes(value)
+        if number == 3:
+            return zlib.decompress(value)
+        if number == 4:
+            return lzma.decompress(value)
+        if number in (5, 6, 7):
+            raise ValueError("the pbf file uses a compression that is not supported, only zlib and lzma are")
+    return b''
+
+
+def check_header(blob):
+    """ Raises an exception if the OSMHeader blob requires features this reader does not support"""
+    for number, value in _fields(decode_blob(blob)):
+        if number == 4:
+            feature = bytes(value).decode('utf-8')
+            if feature not in SUPPORTED_FEATURES:
+                raise ValueError("the pbf file requires the feature {0}, which is not supported".format(feature))
+
+
+# ================================================== #
+#               Primitive Blocks                     #
+# ================================================== #
+
+def decode_block(data):
+    """ Decodes a PrimitiveBlock in plain records, which are cheap to send between processes:
+        ('node', attrib, tags), ('way', attrib, tags, refs) and ('relation', attrib, tags, members)
+    attrib has the same attributes as in the xml files, as strings, tags is a list of (k, v), refs a list of node ids
+    and members a list of (type, ref, role)
+
+    Args:
+        data(bytes): the decompressed PrimitiveBlock
+    Returns:
+        records(list)
+    """
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset, date_granularity = 100, 0, 0, 1000
+    for number, value in _fields(memoryview(data)):
+        if number == 1:
+            strings = [bytes(s).decode('utf-8') for n, s in _fields(value) if n == 1]
+        elif number == 2:
+            groups.append(value)
+        elif number == 17:
+            granularity = _signed(value)
+        elif number == 18:
+            date_granularity = _signed(value)
+        elif number == 19:
+            lat_offset = _signed(value)
+        elif number == 20:
+            lon_offset = _signed(value)
+
+    def coordinates(lat, lon):
+        return ('{0:.7f}'.format((lat_offset + granularity * lat) * 1e-9),
+                '{0:.7f}'.format((lon_offset + granularity * lon) * 1e-9))
+
+    def timestamp(value):
+        return format_timestamp(value * date_granularity // 1000)
+
+    def info_attrib(buf):
+        attrib = {}
+        for number, value in _fields(buf):
+            if number == 1:
+                attrib['version'] = str(_signed(value))
+            elif number == 2:
+                attrib['timestamp'] = timestamp(_signed(value))
+            elif number == 3:
+                attrib['changeset'] = str(_signed(value))
+            elif number == 4:
+                attrib['uid'] = str(_signed(value))
+            elif number == 5:
+                attrib['user'] = strings[value]
+        return attrib
+
+    def tag_list(keys, vals):
+        return [(strings[k], strings[v]) for k, v in zip(keys, vals)]
+
+    records = []
+    for group in groups:
+        for number, value in _fields(group):
+            if number == 1:
+                records.append(_decode_node(value, info_attrib, tag_list, coordinates))
+            elif number == 2:
+                records.extend(_decode_dense(value, strings, coordinates, timestamp))
+            elif number == 3:
+                records.append(_decode_way(value, info_attrib, tag_list))
+            elif number == 4:
+                records.append(_decode_relation(value, info_attrib, tag_list, strings))
+    return records
+
+
+def _decode_node(buf, info_attrib, tag_list, coordinates):
+    attrib = {}
+    keys, vals = [], []
+    lat = lon = 0
+    for number, value in _fields(buf):
+        if number == 1:
+            attrib['id'] = str(_zigzag(value))
+        elif number == 2:
+            keys = _packed(value)
+        elif number == 3:
+            vals = _packed(value)
+        elif number == 4:
+            attrib.update(info_attrib(value))
+        elif number == 8:
+            lat = _zigzag(value)
+        elif number == 9:
+            lon = _zigzag(value)
+    attrib['lat'], attrib['lon'] = coordinates(lat, lon)
+    return 'node', attrib, tag_list(keys, vals)
+
+
+def _decode_dense(buf, strings, coordinates, timestamp):
+    ids, lats, lons, keys_vals = [], [], [], []
+    info = {}
+    for number, value in _fields(buf):
+        if number == 1:
+            ids = _delta(_packed_sint(value))
+        elif number == 5:
+            for info_number, info_value in _fields(value):
+                if info_number == 1:
+                    info['version'] = [str(_signed(v)) for v in _packed(info_value)]
+                elif info_number == 2:
+                    info['timestamp'] = [timestamp(v) for v in _delta(_packed_sint(info_value))]
+                elif info_number == 3:
+                    info['changeset'] = [str(v) for v in _delta(_packed_sint(info_value))]
+                elif info_number == 4:
+                    info['uid'] = [str(v) for v in _delta(_packed_sint(info_value))]
+                elif info_number == 5:
+                    info['user'] = [strings[v] for v in _delta(_packed_sint(info_value))]
+        elif number == 8:
+            lats = _delta(_packed_sint(value))
+        elif number == 9:
+            lons = _delta(_packed_sint(value))
+        elif number == 10:
+            keys_vals = _packed(value)
+    records = []
+    pos = 0
+    for i, node_id in enumerate(ids):
+        attrib = {'id': str(node_id)}
+        attrib['lat'], attrib['lon'] = coordinates(lats[i], lons[i])
+        for name, values in info.items():
+            attrib[name] = values[i]
+        tags = []
+        # the keys and values of all the nodes, each node ends with a 0
+        while pos < len(keys_vals) and keys_vals[pos] != 0:
+            tags.append((strings[keys_vals[pos]], strings[keys_vals[pos + 1]]))
+            pos += 2
+        pos += 1
+        records.append(('node', attrib, tags))
+    return records
+
+
+def _decode_way(buf, info_attrib, tag_list):
+    attrib = {}
+    keys, vals, refs = [], [], []
+    for number, value in _fields(buf):
+        if number == 1:
+            attrib['id'] = str(_signed(value))
+        elif number == 2:
+            keys = _packed(value)
+        elif number == 3:
+            vals = _packed(value)
+        elif number == 4:
+            attrib.update(info_attrib(value))
+        elif number == 8:
+            refs = _delta(_packed_sint(value))
+    return 'way', attrib, tag_list(keys, vals), refs
+
+
+def _decode_relation(buf, info_attrib, tag_list, strings):
+    attrib = {}
+    keys, vals, roles, member_ids, types = [], [], [], [], []
+    for number, value in _fields(buf):
+        if number == 1:
+            attrib['id'] = str(_signed(value))
+        elif number == 2:
+            keys = _packed(value)
+        elif number == 3:
+            vals = _packed(value)
+        elif number == 4:
+            attrib.update(info_attrib(value))
+        elif number == 8:
+            roles = _packed(value)
+        elif number == 9:
+            member_ids = _delta(_packed_sint(value))
+        elif number == 10:
+            types = _packed(value)
+    members = [(MEMBER_TYPES[t], ref, strings[role]) for t, ref, role in zip(types, member_ids, roles)]
+    return 'relation', attrib, tag_list(keys, vals), members
+
+
+def _decode_data_blob(blob):
+    """ Decompresses and decodes an OSMData blob, run in the processes of the pool"""
+    return decode_block(decode_blob(blob))
+
+
+# ================================================== #
+#               Elements                             #
+# ================================================== #
+
+def to_element(record):
+    """ Builds the ElementTree element of a record returned by decode_block, with the same tag and attributes as the
+    element of an xml file"""
+    element = ET.Element(record[0], record[1])
+    if record[0] == 'way':
+        for ref in record[3]:
+            ET.SubElement(element, 'nd', {'ref': str(ref)})
+    elif record[0] == 'relation':
+        for member_type, ref, role in record[3]:
+            ET.SubElement(element, 'member', {'type': member_type, 'ref': str(ref), 'role': role})
+    for k, v in record[2]:
+        ET.SubElement(element, 'tag', {'k': k, 'v': v})
+    return element
+
+
+def _data_blobs(pbf_file):
+    """ Yields the OSMData blobs of a pbf file, after checking its header"""
+    for blob_type, blob in read_blobs(pbf_file):
+        if blob_type == 'OSMHeader':
+            check_header(blob)
+        elif blob_type == 'OSMData':
+            yield blob
+
+
+def iter_records(pbf_file, processes=None):
+    """ Yields the records of a pbf file in the order of the file. The blobs are decoded by a pool of processes, with
+    a few blobs per process in flight so the file is not read whole in memory
+
+    Args:
+        pbf_file(str): name of the pbf file
+        processes(int): number of processes, by default the number of cores. With 1 the blobs are decoded in this
+            process
+    """
+    processes = processes or multiprocessing.cpu_count()
+    data_blobs = _data_blobs(pbf_file)
+    if processes == 1:
+        for blob in data_blobs:
+            for record in _decode_data_blob(blob):
+                yield record
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = deque()
+        for blob in data_blobs:
+            pending.append(pool.apply_async(_decode_data_blob, (blob,)))
+            if len(pending) >= 2 * processes:
+                for record in pending.popleft().get():
+                    yield record
+        while pending:
+            for record in pending.popleft().get():
+                yield record
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_elements(pbf_file, tags=('node', 'way', 'relation'), processes=None):
+    """ Yields the elements of a pbf file whose tag is in tags
+
+    Args:
+        pbf_file(str): name of the pbf file
+        tags(tuple): top level tags to yield
+        processes(int): number of processes that decode the blobs, by default the number of cores
+    """
+    for record in iter_records(pbf_file, processes):
+        if record[0] in tags:
+            yield to_element(record)
@@ -0,0 +1,112 @@
+""" Runs the audits, the cleaning and the csv export with a single pass over the osm file"""
+
+import argparse
+from c_audit_streets import StreetAuditStage
+from d_audit_coordinates import CoordinateAuditStage, print_report
+from e_audit_postal_codes import PostalCodeAuditStage, get_postalcode_set, get_postal_index, OSMFILE, \
+    POSTALCODES_FILE, POSTAL_CODE_AUDIT_CODE
+from f_clean_osm_data import CleaningStage, NORMALISER
+from g_write_csv import ShapeStage, CsvWriter, KEY_CLASSIFIER, add_sampling_arguments, validation_from_args
+from h_create_db import SqliteWriter
+from j_write_parquet import ParquetWriter
+from node_store import NODE_INDEX_FILE
+from osm_io import iter_elements, PARSER_CODE
+from stage_cache import CachedStage, add_cache_arguments, cache_from_args
+
+
+""" Each stage is an object with two methods:
+    - process(element): receives a top level element and returns it, a modified version of it, or None if the
+      element should not be sent to the following stages
+    - finish(): called once the whole file was read, returns the result of the stage
+    The audit stages are registered before the cleaning stage so they see the original values."""
+
+
+class Pipeline(object):
+    """ Sends every top level element of an osm file through the registered stages, in order"""
+
+    def __init__(self, stages=()):
+        self.stages = list(stages)
+
+    def register(self, stage):
+        self.stages.append(stage)
+        return stage
+
+    def run(self, osmfile, tags=('node', 'way', 'relation')):
+        """ Parses the osm file once and returns a list with the result of each stage
+
+        Args:
+            osmfile(str): name of the osm file, it can be compressed (.osm.gz, .osm.bz2 or .osm.xz) or a .osm.pbf file
+            tags(tuple): top level tags that are sent to the stages
+        Returns:
+            results(list): what each stage returned from finish, in the order the stages were registered
+        """
+        for element in iter_elements(osmfile, tags):
+            for stage in self.stages:
+                element = stage.process(element)
+                if element is None:
+                    break
+        return [stage.finish() for stage in self.stages]
+
+
+def build_pipeline(validate=False, writer=None, node_store=None, geometry=False, osmfile=None, cache=None):
+    """ Creates the pipeline that audits the streets, coordinates and postal codes, cleans the data and writes the
+    csv files, or sends the elements to the given writer. validate can be a bool or a ValidationSample. If a
+    NodeStore is given the cleaned nodes are also kept in it, and with geometry the length, bounding box and centroid
+    of the ways are also written. If a StageCache and the osm file are given, the street and postal codes audits are
+    skipped when the cache has their results"""
+    set_postalcodes = get_postalcode_set(POSTALCODES_FILE)
+    street_audit = StreetAuditStage()
+    postal_code_audit = PostalCodeAuditStage(set_postalcodes)
+    if cache is not None and osmfile is not None:
+        street_audit = CachedStage(street_audit, cache, 'street_audit_stage', [osmfile], PARSER_CODE)
+        # same result and key as e_audit_postal_codes.verify_postal_codes, so they share it
+        postal_code_audit = CachedStage(postal_code_audit, cache, 'verify_postal_codes', [osmfile, POSTALCODES_FILE],
+                                        POSTAL_CODE_AUDIT_CODE)
+    return Pipeline([street_audit,
+                     CoordinateAuditStage(),
+                     postal_code_audit,
+                     CleaningStage(get_postal_index(POSTALCODES_FILE)),
+                     ShapeStage(writer or CsvWriter(geometry=geometry), validate, node_store,
+                                geometry_index=NODE_INDEX_FILE if geometry else None)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit, clean and export an osm file to csv in a single pass")
+    parser.add_argument('osm_file', nargs='?', default=OSMFILE)
+    parser.add_argument('--validate', action='store_true', help="validate each element against the schema")
+    parser.add_argument('--sqlite', metavar='SQLITE_FILE',
+                        help="insert the elements directly in a new data base instead of writing csv files")
+    parser.add_argument('--parquet', metavar='OUTPUT_DIR',
+                        help="write typed and compressed parquet files to this directory instead of csv files "
+                             "(needs pyarrow)")
+    parser.add_argument('--geometry', action='store_true',
+                        help="also write the length, bounding box and centroid of each way")
+    add_sampling_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    writer = None
+    if args.sqlite:
+        writer = SqliteWriter(args.sqlite, fast=True)
+    elif args.parquet:
+        writer = ParquetWriter(args.parquet)
+    pipeline = build_pipeline(validation_from_args(args), writer, geometry=args.geometry, osmfile=args.osm_file,
+                              cache=cache_from_args(args))
+    street_types, coordinates, postal_codes, deleted, _ = pipeline.run(args.osm_file)
+    invalid, not_in_set, not_inset_cut, strange = postal_codes
+    print("street types", len(street_types))
+    print("coordinates outside the area", len(coordinates['outliers']))
+    print_report(coordinates)
+    print("invalid_pc", invalid)
+    print("not_in_set_pc", not_in_set)
+    print("not_in_set_cut", not_inset_cut)
+    print("strange_pc", strange)
+    print("deleted elements", deleted)
+    print("street names cache", NORMALISER.stats())
+    print("tag keys cache", KEY_CLASSIFIER.stats())
+    shape_stage = pipeline.stages[-1]
+    if shape_stage.report is not None:
+        print(shape_stage.report.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+""" Index of the postal codes of BA_postalcodes.csv, written once to memory-mapped files"""
+
+import argparse
+import csv
+import os
+import re
+import tempfile
+from collections import namedtuple
+import numpy as np
+from stage_cache import file_hash
+
+# Columns of BA_postalcodes.csv, the rows can have fewer columns than these
+CPA_COLUMN = 1
+LOCALITY_COLUMN = 2
+STREET_COLUMN = 3
+FROM_COLUMN = 4
+TO_COLUMN = 5
+
+# The CPA (Código Postal Argentino) is the letter of the province, the 4 digits of the old postal code and 3 letters
+# for the side of the block, for example B1900AAA. The letter of the province is left out of the keys, as many osm
+# values have the wrong one or none
+KEY_DTYPE = np.dtype('S7')
+CODE_DTYPE = np.dtype('S4')
+
+# Separators and spaces that are dropped before a value is looked up, like the dot of '1.852'
+SEPARATORS_RE = re.compile(r'[\s.\-]')
+CPA_RE = re.compile(r'^[A-Z]?([0-9]{4})([A-Z]{0,3})$')
+
+PostalCode = namedtuple('PostalCode', ['code', 'cpa', 'locality', 'street', 'from_number', 'to_number'])
+
+
+def index_path(csv_file):
+    """ Returns the name of the main file of the index of a postal codes csv file"""
+    return os.path.splitext(csv_file)[0] + '_index.npy'
+
+
+def _sibling(path, name):
+    return os.path.splitext(path)[0] + '_' + name
+
+
+def _save(path, data):
+    """ Writes a .npy file, or a text file if data is a str, atomically, so a process that loads the index while
+    another one builds it never reads half a file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(data, str):
+                f.write(data.encode('ascii'))
+            else:
+                np.save(f, data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return -1
+
+
+class PostalCodeIndex(object):
+    """ The postal codes of BA_postalcodes.csv sorted in .npy files that are memory-mapped, so loading the index does
+    not read the csv file. There is a key for each row of the csv file, the CPA without the letter of the province,
+    and the rows of each 4 digits code are next to each other. The keys are kept in their own arrays, so they are
+    searched without copying them:
+        - path: the sorted keys, and _rows.npy: locality, street, from and to of each key
+        - _codes.npy: the sorted 4 digits codes, and _ranges.npy: first row and row after the last one of each code
+        - _strings.npy: the names of the localities and streets
+
+    Args:
+        path(str): main file written by PostalCodeIndex.build
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = np.load(path, mmap_mode='r')
+        self.rows = np.load(_sibling(path, 'rows.npy'), mmap_mode='r')
+        self.code_keys = np.load(_sibling(path, 'codes.npy'), mmap_mode='r')
+        self.ranges = np.load(_sibling(path, 'ranges.npy'), mmap_mode='r')
+        self.strings = np.load(_sibling(path, 'strings.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.code_keys)
+
+    def __contains__(self, value):
+        """ True for the 4 digits codes and the CPA without the letter of the province that are in the csv file"""
+        return self._find(value) is not None
+
+    @classmethod
+    def build(cls, csv_file, path=None):
+        """ Reads a postal codes csv file and writes its index
+
+        Args:
+            csv_file(str): the Buenos Aires postal codes dataset
+            path(str): name of the main file, next to the csv file by default
+        """
+        path = path or index_path(csv_file)
+        keys, rows = [], []
+        strings = {'': 0}
+        with open(csv_file, "r") as csvfile:
+            csvread = csv.reader(csvfile)
+            next(csvread, None)  # to start from the second row
+            for row in csvread:
+                row = row + [''] * (TO_COLUMN + 1 - len(row))
+                locality = strings.setdefault(row[LOCALITY_COLUMN], len(strings))
+                street = strings.setdefault(row[STREET_COLUMN], len(strings))
+                keys.append(row[CPA_COLUMN][1:8].encode('ascii', 'replace'))
+                rows.append((locality, street, _int(row[FROM_COLUMN]), _int(row[TO_COLUMN])))
+        keys = np.array(keys, dtype=KEY_DTYPE)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        codes, starts = np.unique(keys.astype(CODE_DTYPE), return_index=True)
+        _save(path, keys)
+        _save(_sibling(path, 'rows.npy'), np.array(rows, dtype=np.int32).reshape(-1, 4)[order])
+        _save(_sibling(path, 'codes.npy'), codes)
+        _save(_sibling(path, 'ranges.npy'), np.stack([starts, np.append(starts[1:], len(keys))], axis=1)
+              .astype(np.int32))
+        _save(_sibling(path, 'strings.npy'), np.array(sorted(strings, key=strings.get)))
+        _save(_sibling(path, 'source.sha256'), file_hash(csv_file))  # last, it marks the index as complete
+        return cls(path)
+
+    @classmethod
+    def load(cls, csv_file, path=None):
+        """ Returns the index of a postal codes csv file, building it if it does not exist or the csv file changed
+
+        Args:
+            csv_file(str): the Buenos Aires postal codes dataset
+            path(str): name of the main file, next to the csv file by default
+        """
+        path = path or index_path(csv_file)
+        try:
+            with open(_sibling(path, 'source.sha256')) as f:
+                up_to_date = f.read() == file_hash(csv_file)
+        except IOError:
+            up_to_date = False
+        return cls(path) if up_to_date else cls.build(csv_file, path)
+
+    def codes(self):
+        """ Returns the 4 digits codes of the index as a list of str"""
+        return [code.decode('ascii') for code in self.code_keys.tolist()]
+
+    def _find(self, key):
+        """ Returns the first row and the row after the last one of a 4 digits code or a 7 characters key, or None if
+        it is not in the index"""
+        try:
+            key = key.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        if len(key) == 4:
+            position = np.searchsorted(self.code_keys, key)
+            if position < len(self.code_keys) and self.code_keys[position] == key:
+                start, stop = self.ranges[position].tolist()
+                return start, stop
+        elif len(key) == 7:
+            start, stop = np.searchsorted(self.keys, key), np.searchsorted(self.keys, key, side='right')
+            if start < stop:
+                return int(start), int(stop)
+        return None
+
+    @staticmethod
+    def parse(value):
+        """ Reads the 4 digits code and the letters of the block of a postal code, without looking them up. The spaces,
+        dots and dashes are dropped and the letters upper cased, and then the value has to be 4 digits with an
+        optional letter before them and up to 3 letters after them, like '1.852', 'C1439AG', '1686S' or 'B1900AAA'
+
+        Args:
+            value(str): the value of an addr:postcode tag
+        Returns:
+            code(str), block(str): the 4 digits and the letters after them, or None if the value does not have that
+                format
+        """
+        match = CPA_RE.match(SEPARATORS_RE.sub('', value.upper()))
+        return None if match is None else match.groups()
+
+    def lookup(self, value):
+        """ Validates and corrects a postal code with a binary search in the index. The value is read with parse. A
+        complete CPA is looked up as it is, otherwise the 4 digits are
+
+        Args:
+            value(str): the value of an addr:postcode tag
+        Returns:
+            postal_code(PostalCode): code is the 4 digits code, cpa the key of the csv file, the CPA without the letter
+                of the province, if the value had all its letters, and the locality and street range are the ones of
+                the first row of the csv file. None if the value does not have that format or its code is not in the
+                index
+        """
+        parsed = self.parse(value)
+        if parsed is None:
+            return None
+        code, block = parsed
+        rows = self._find(code + block) if len(block) == 3 else None
+        cpa = rows is not None
+        rows = rows or self._find(code)
+        if rows is None:
+            return None
+        locality, street, from_number, to_number = self.rows[rows[0]].tolist()
+        return PostalCode(code, self.keys[rows[0]].decode('ascii') if cpa else None, str(self.strings[locality]),
+                          str(self.strings[street]), from_number, to_number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the index of a postal codes csv file and look up values")
+    parser.add_argument('csv_file', nargs='?', default="BA_postalcodes.csv")
+    parser.add_argument('values', nargs='*', help="postal codes to look up")
+    parser.add_argument('--rebuild', action='store_true', help="build the index even if it is up to date")
+    args = parser.parse_args()
+    index = PostalCodeIndex.build(args.csv_file) if args.rebuild else PostalCodeIndex.load(args.csv_file)
+    print("{0}: {1} rows, {2} codes".format(index.path, len(index.keys), len(index)))
+    for value in args.values:
+        print(repr(value), index.lookup(value))
+
+
+if __name__ == '__main__':
+    main()
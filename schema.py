@@ -1,65 +1,116 @@
-# Note: The schema is stored in a .py file in order to take advantage of the
-# int() and float() type coercion functions. Otherwise it could easily stored as
-# as JSON or another serialized format.
-
-schema = {
-    'node': {
-        'type': 'dict',
-        'schema': {
-            'id': {'required': True, 'type': 'integer', 'coerce': int},
-            'lat': {'required': True, 'type': 'float', 'coerce': float},
-            'lon': {'required': True, 'type': 'float', 'coerce': float},
-            'user': {'required': True, 'type': 'string'},
-            'uid': {'required': True, 'type': 'integer', 'coerce': int},
-            'version': {'required': True, 'type': 'string'},
-            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
-            'timestamp': {'required': True, 'type': 'string'}
-        }
-    },
-    'node_tags': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'key': {'required': True, 'type': 'string'},
-                'value': {'required': True, 'type': 'string'},
-                'type': {'required': True, 'type': 'string'}
-            }
-        }
-    },
-    'way': {
-        'type': 'dict',
-        'schema': {
-            'id': {'required': True, 'type': 'integer', 'coerce': int},
-            'user': {'required': True, 'type': 'string'},
-            'uid': {'required': True, 'type': 'integer', 'coerce': int},
-            'version': {'required': True, 'type': 'string'},
-            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
-            'timestamp': {'required': True, 'type': 'string'}
-        }
-    },
-    'way_nodes': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'node_id': {'required': True, 'type': 'integer', 'coerce': int},
-                'position': {'required': True, 'type': 'integer', 'coerce': int}
-            }
-        }
-    },
-    'way_tags': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'key': {'required': True, 'type': 'string'},
-                'value': {'required': True, 'type': 'string'},
-                'type': {'required': True, 'type': 'string'}
-            }
-        }
-    }
-}
\ No newline at end of file
+# Note: The schema is stored in a .py file in order to take advantage of the
+# int() and float() type coercion functions. Otherwise it could easily stored as
+# as JSON or another serialized format.
+
+schema = {
+    'node': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'lat': {'required': True, 'type': 'float', 'coerce': float},
+            'lon': {'required': True, 'type': 'float', 'coerce': float},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'node_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
+    },
+    'way': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'way_nodes': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'node_id': {'required': True, 'type': 'integer', 'coerce': int},
+                'position': {'required': True, 'type': 'integer', 'coerce': int}
+            }
+        }
+    },
+    'way_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
+    },
+    'relation': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'relation_members': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'member_id': {'required': True, 'type': 'integer', 'coerce': int},
+                'member_type': {'required': True, 'type': 'string'},
+                'role': {'required': True, 'type': 'string'},
+                'position': {'required': True, 'type': 'integer', 'coerce': int}
+            }
+        }
+    },
+    'relation_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
+    },
+    # Only in the ways shaped with a g_write_csv.ShapeStage that has a geometry index
+    'way_geometry': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'length': {'required': True, 'type': 'float', 'coerce': float},
+            'min_lat': {'required': True, 'type': 'float', 'coerce': float},
+            'min_lon': {'required': True, 'type': 'float', 'coerce': float},
+            'max_lat': {'required': True, 'type': 'float', 'coerce': float},
+            'max_lon': {'required': True, 'type': 'float', 'coerce': float},
+            'centroid_lat': {'required': True, 'type': 'float', 'coerce': float},
+            'centroid_lon': {'required': True, 'type': 'float', 'coerce': float},
+            'missing_nodes': {'required': True, 'type': 'integer', 'coerce': int}
+        }
+    }
+}
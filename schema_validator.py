@@ -0,0 +1,266 @@
+""" Validates the shaped elements against schema.py without cerberus"""
+
+import random
+from collections import Counter
+from collections.abc import Mapping, Sequence
+import schema
+
+SCHEMA = schema.schema
+
+# Types of the schema and the python types they accept, as in cerberus
+TYPES = {'integer': (int,),
+         'float': (float, int),
+         'string': (str,),
+         'dict': (Mapping,),
+         'list': (Sequence,)}
+
+
+def _is_type(value, type_name):
+    if type_name == 'list' and isinstance(value, str):
+        return False
+    return isinstance(value, TYPES[type_name])
+
+
+class CompiledValidator(object):
+    """ Validates the elements returned by g_write_csv.shape_element. Each schema is compiled once into a flat list
+    of (field, required, type, coerce) checks per part, so validating an element is a loop over its fields instead
+    of walking the nested schema.
+
+    The errors have the same format and messages as cerberus.Validator.errors, for example
+    {'node': [{'id': ['must be of integer type', "field 'id' cannot be coerced: ..."]}]}
+
+    Args:
+        schema(dict): the default schema, schema.schema if not given
+    """
+
+    def __init__(self, schema=SCHEMA):
+        self.schema = schema
+        self.errors = {}
+        self._compiled = {}
+
+    def compile(self, schema):
+        """ Returns the checks of a schema: part -> (kind, fields), where kind is 'dict' for a single row and 'list'
+        for a list of rows, and fields is a dict field -> (required, type, coerce)"""
+        key = id(schema)
+        if key not in self._compiled:
+            parts = {}
+            for part, rules in schema.items():
+                part_schema = rules['schema']
+                if rules['type'] == 'list':
+                    part_schema = part_schema['schema']
+                fields = {field: (field_rules.get('required', False), field_rules['type'], field_rules.get('coerce'))
+                          for field, field_rules in part_schema.items()}
+                parts[part] = (rules['type'], fields)
+            self._compiled[key] = (schema, parts)
+        return self._compiled[key][1]
+
+    def validate(self, document, schema=None):
+        """ Validates an element. The errors are kept in self.errors
+
+        Args:
+            document(dict): the shaped element
+            schema(dict): the schema, the one given when the validator was created if None
+        Returns:
+            valid(bool)
+        """
+        parts = self.compile(self.schema if schema is None else schema)
+        errors = {}
+        for part, value in document.items():
+            if part not in parts:
+                errors[part] = ['unknown field']
+                continue
+            kind, fields = parts[part]
+            if value is None:
+                errors[part] = ['null value not allowed']
+            elif not _is_type(value, kind):
+                errors[part] = ['must be of {0} type'.format(kind)]
+            elif kind == 'dict':
+                row_errors = _row_errors(value, fields)
+                if row_errors:
+                    errors[part] = [row_errors]
+            else:
+                rows_errors = self._rows_errors(value, fields)
+                if rows_errors:
+                    errors[part] = [rows_errors]
+        self.errors = dict(sorted(errors.items()))
+        return not errors
+
+    def validate_rows(self, part, rows, schema=None):
+        """ Validates a chunk of rows of the same part, for example the node_tags of many elements or a chunk of a
+        csv file. Each field is checked for the whole chunk before the next field
+
+        Args:
+            part(str): a key of the schema, for example 'node' or 'way_tags'
+            rows(list): dicts with the fields of the part
+            schema(dict): the schema, the one given when the validator was created if None
+        Returns:
+            errors(dict): index of the row -> list with the errors of the row, in the format of self.errors
+        """
+        kind, fields = self.compile(self.schema if schema is None else schema)[part]
+        return self._rows_errors(rows, fields)
+
+    @staticmethod
+    def _rows_errors(rows, fields):
+        errors = {}
+        dict_rows = []
+        for i, row in enumerate(rows):
+            if isinstance(row, Mapping):
+                dict_rows.append((i, row))
+            elif row is None:
+                errors[i] = ['null value not allowed']
+            else:
+                errors[i] = ['must be of dict type']
+        row_errors = {}
+        for field, (required, type_name, coerce) in fields.items():
+            for i, row in dict_rows:
+                if field in row:
+                    messages = _field_errors(field, row[field], type_name, coerce)
+                    if messages:
+                        row_errors.setdefault(i, {})[field] = messages
+                elif required:
+                    row_errors.setdefault(i, {})[field] = ['required field']
+        for i, row in dict_rows:
+            for field in row:
+                if field not in fields:
+                    row_errors.setdefault(i, {})[field] = ['unknown field']
+        for i, field_errors in row_errors.items():
+            errors[i] = [dict(sorted(field_errors.items()))]
+        return dict(sorted(errors.items()))
+
+
+def _row_errors(row, fields):
+    """ Returns the errors of the fields of a row, field -> list of messages"""
+    errors = {}
+    for field, (required, type_name, coerce) in fields.items():
+        if field in row:
+            messages = _field_errors(field, row[field], type_name, coerce)
+            if messages:
+                errors[field] = messages
+        elif required:
+            errors[field] = ['required field']
+    for field in row:
+        if field not in fields:
+            errors[field] = ['unknown field']
+    return dict(sorted(errors.items()))
+
+
+def _field_errors(field, value, type_name, coerce):
+    """ Returns the error messages of a value, an empty list if it is valid"""
+    if value is None:  # cerberus still tries to coerce the null values
+        messages = ['null value not allowed']
+        if coerce is not None:
+            try:
+                coerce(value)
+            except Exception as e:
+                messages.append("field '{0}' cannot be coerced: {1}".format(field, e))
+        return messages
+    if coerce is None:
+        return [] if _is_type(value, type_name) else ['must be of {0} type'.format(type_name)]
+    try:
+        coerced = coerce(value)
+    except Exception as e:
+        messages = [] if _is_type(value, type_name) else ['must be of {0} type'.format(type_name)]
+        return messages + ["field '{0}' cannot be coerced: {1}".format(field, e)]
+    return [] if _is_type(coerced, type_name) else ['must be of {0} type'.format(type_name)]
+
+
+class ValidationSample(object):
+    """ Chooses which elements are validated, so validation costs a fraction of the run. The counts are kept for each
+    element type ('node', 'way', 'relation'). An element is validated if any of the given rules selects it.
+
+    Args:
+        every(int): validate every k-th element, like a_write_samples.write_sample_data does
+        fraction(float): validate each element with this probability
+        first(int): validate the first N elements
+        seed(int): seed of the random numbers used with fraction, so a run can be repeated
+    """
+
+    def __init__(self, every=None, fraction=None, first=None, seed=None):
+        if every is None and fraction is None and first is None:
+            raise ValueError("at least one of every, fraction or first has to be given")
+        self.every = every
+        self.fraction = fraction
+        self.first = first
+        self.random = random.Random(seed)
+        self.seen = Counter()
+
+    def select(self, element_type):
+        """ Returns True if the next element of this type has to be validated"""
+        i = self.seen[element_type]
+        self.seen[element_type] += 1
+        if self.first is not None and i < self.first:
+            return True
+        if self.every is not None and i % self.every == 0:
+            return True
+        return self.fraction is not None and self.random.random() < self.fraction
+
+
+class ValidationReport(object):
+    """ Counts the validated and invalid elements of each type, and the invalid elements of each field, instead of
+    stopping at the first invalid element. The fields are named part.field, like 'node.lat' or 'way_tags.id'
+    """
+
+    def __init__(self):
+        self.seen = Counter()
+        self.validated = Counter()
+        self.invalid = Counter()
+        self.field_errors = Counter()
+        self.examples = {}  # first error message of each field
+
+    def add(self, element_type, errors=None, validated=True):
+        """ Counts an element
+
+        Args:
+            element_type(str): 'node', 'way' or 'relation'
+            errors(dict): the errors of the validator, empty or None if the element is valid
+            validated(bool): False for the elements that were not selected for validation
+        """
+        self.seen[element_type] += 1
+        if not validated:
+            return
+        self.validated[element_type] += 1
+        if errors:
+            self.invalid[element_type] += 1
+            fields = {}
+            for field, message in error_fields(errors):
+                fields.setdefault(field, message)
+            for field, message in fields.items():  # each field is counted once per element
+                self.field_errors[field] += 1
+                self.examples.setdefault(field, message)
+
+    def update(self, other):
+        """ Adds the counts of another report, for example the one of another shard"""
+        self.seen.update(other.seen)
+        self.validated.update(other.validated)
+        self.invalid.update(other.invalid)
+        self.field_errors.update(other.field_errors)
+        for field, message in other.examples.items():
+            self.examples.setdefault(field, message)
+
+    def summary(self):
+        """ Returns the counts and the histogram of errors per field as text"""
+        lines = []
+        for element_type in sorted(self.seen):
+            seen = self.seen[element_type]
+            validated = self.validated[element_type]
+            lines.append("{0}: validated {1} of {2} ({3:.1f}%), {4} invalid".format(
+                element_type, validated, seen, 100.0 * validated / seen if seen else 0, self.invalid[element_type]))
+        if self.field_errors:
+            width = max(len(field) for field in self.field_errors)
+            lines.append('{0:<{1}}  {2:>8}  {3}'.format('field', width, 'errors', 'example'))
+            for field, count in self.field_errors.most_common():
+                lines.append('{0:<{1}}  {2:>8}  {3}'.format(field, width, count, self.examples[field]))
+        return '\n'.join(lines)
+
+
+def error_fields(errors, prefix=''):
+    """ Yields (field, message) for each field of the errors of a validator, with the name of the part before the
+    field and without the positions of the rows, for example ('node_tags.id', 'must be of integer type')"""
+    for field, messages in errors.items():
+        name = prefix if isinstance(field, int) else (prefix + '.' + field if prefix else field)
+        for message in messages:
+            if isinstance(message, dict):
+                for item in error_fields(message, name):
+                    yield item
+            else:
+                yield name, message
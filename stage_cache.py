@@ -0,0 +1,220 @@
+""" Keeps the results of the audits on disk, so they are not computed again while the osm file does not change.
+
+Each result is stored under a key made of the name of the stage and the sha256 of the files it depends on: the osm
+file, data files like BA_postalcodes.csv and the source of the module that computes it. Changing any of them changes
+the key, so an outdated result is never returned, and the old results are evicted, least recently used first, when
+the cache is bigger than max_bytes"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+
+CACHE_DIR = '.stage_cache'
+MAX_BYTES = 256 * 1024 * 1024
+CACHE_VERSION = 1  # changes the keys of all the stages, for changes in this module
+
+HASHES_FILE = 'hashes.json'
+RESULT_SUFFIX = '.pickle'
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """ Returns the sha256 of the content of a file
+
+    Args:
+        path(str): name of the file
+        chunk_size(int): bytes read at a time
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class StageCache(object):
+    """ Stores the result of a stage in a pickle file per key, in cache_dir. The directory is only created when a
+    result is stored.
+
+    Hashing a big osm file takes a full read of it, so the hashes are also kept in cache_dir with the size and the
+    modification time of each file, and a file is only read again when one of them changes
+
+    Args:
+        cache_dir(str): directory of the cache
+        max_bytes(int): size of the results kept, the least recently used ones are deleted above it
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._hashes = None
+
+    def hash(self, path):
+        """ Returns the sha256 of a file, reading it only if it changed since it was last hashed"""
+        if self._hashes is None:
+            try:
+                with open(os.path.join(self.cache_dir, HASHES_FILE)) as f:
+                    self._hashes = json.load(f)
+            except (IOError, ValueError):
+                self._hashes = {}
+        path = os.path.abspath(os.fsdecode(path))
+        stat = os.stat(path)
+        known = self._hashes.get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = file_hash(path)
+        self._hashes[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        if os.path.isdir(self.cache_dir):
+            self._write(HASHES_FILE, json.dumps(self._hashes).encode('utf-8'))
+        return digest
+
+    def key(self, stage, input_files, code=()):
+        """ Returns the key of the result of a stage
+
+        Args:
+            stage(str): name of the stage, for example 'audit_streets'
+            input_files(list): names of the files the stage reads
+            code(list): functions, classes or modules whose source computes the result
+        """
+        sha = hashlib.sha256('{0}:{1}'.format(stage, CACHE_VERSION).encode('utf-8'))
+        for path in input_files:
+            sha.update(self.hash(path).encode('ascii'))
+        for obj in code:
+            sha.update(self.hash(inspect.getsourcefile(obj)).encode('ascii'))
+        return '{0}-{1}'.format(stage, sha.hexdigest()[:32])
+
+    def get(self, key):
+        """ Returns (True, result) if the cache has a result for the key and (False, None) otherwise"""
+        path = os.path.join(self.cache_dir, key + RESULT_SUFFIX)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return False, None
+        os.utime(path)  # the modification time is used as the last access time for the eviction
+        return True, result
+
+    def put(self, key, result):
+        """ Stores the result of a key and evicts the oldest results if the cache is too big"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._write(key + RESULT_SUFFIX, pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+        if self._hashes:
+            self._write(HASHES_FILE, json.dumps(self._hashes).encode('utf-8'))
+        self.evict()
+
+    def cached(self, stage, input_files, code, compute):
+        """ Returns the result of a stage from the cache, or computes it with compute() and stores it
+
+        Args:
+            stage(str), input_files(list), code(list): see key
+            compute(function): called without arguments when the result is not in the cache
+        """
+        key = self.key(stage, input_files, code)
+        hit, result = self.get(key)
+        if not hit:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def results(self):
+        """ Returns (modification time, size, path) of each stored result, the oldest first"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        results = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(RESULT_SUFFIX):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                results.append((stat.st_mtime, stat.st_size, path))
+        return sorted(results)
+
+    def evict(self):
+        """ Deletes the least recently used results until the cache is at most max_bytes"""
+        results = self.results()
+        total = sum(size for mtime, size, path in results)
+        for mtime, size, path in results[:-1]:  # the newest result is kept even if it is bigger than max_bytes
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self, stage=None):
+        """ Deletes the results of a stage, or the whole cache if stage is None"""
+        for mtime, size, path in self.results():
+            if stage is None or os.path.basename(path).startswith(stage + '-'):
+                os.remove(path)
+        if stage is None and os.path.exists(os.path.join(self.cache_dir, HASHES_FILE)):
+            os.remove(os.path.join(self.cache_dir, HASHES_FILE))
+            self._hashes = None
+
+    def _write(self, name, data):
+        """ Writes a file of the cache atomically, so a process that is killed does not leave half a result"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.cache_dir, name))
+
+
+CACHE = StageCache()
+
+
+class CachedStage(object):
+    """ Wraps an audit stage of the pipeline. If the cache has the result of the stage for the input files the stage
+    does not run, the elements are passed through and finish returns the stored result. Otherwise the stage runs and
+    its result is stored
+
+    Args:
+        stage: the audit stage, it must return the element it receives without changing it
+        cache(StageCache)
+        name(str), input_files(list): see StageCache.key
+        code(list): see StageCache.key, the code the stage uses besides its class, whose source is always part of the
+            key
+    """
+
+    def __init__(self, stage, cache, name, input_files, code=()):
+        self.cache = cache
+        self.key = cache.key(name, input_files, [type(stage)] + list(code))
+        self.hit, self.result = cache.get(self.key)
+        self.stage = None if self.hit else stage
+
+    def process(self, element):
+        if self.stage is None:
+            return element
+        return self.stage.process(element)
+
+    def finish(self):
+        if self.stage is not None:
+            self.result = self.stage.finish()
+            self.cache.put(self.key, self.result)
+        return self.result
+
+
+def add_cache_arguments(parser):
+    """ Adds the --no-cache option to the parser of a script that uses the cache"""
+    parser.add_argument('--no-cache', action='store_true',
+                        help="compute the audits again instead of using the results kept in " + CACHE_DIR)
+
+
+def cache_from_args(args):
+    """ Returns CACHE, or None if --no-cache was given"""
+    return None if args.no_cache else CACHE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or clear the audit results kept on disk")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--clear', action='store_true', help="delete all the results")
+    parser.add_argument('--clear-stage', metavar='STAGE', help="delete the results of a stage")
+    args = parser.parse_args()
+    cache = StageCache(args.cache_dir)
+    if args.clear or args.clear_stage:
+        cache.clear(args.clear_stage)
+    for mtime, size, path in cache.results():
+        print("{0:.1f} KB  {1}".format(size / 1e3, os.path.basename(path)))
+
+
+if __name__ == '__main__':
+    main()